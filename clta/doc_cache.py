@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+
+class DocCache(object):
+    """Least-recently-used cache of tokenized passages for DrQA rewards.
+
+    Entries are dicts holding the passage ``ids`` and ``offsets`` and, when
+    ``cache_encodings`` is set, the question-independent ``encoding``
+    (see :func:`DrQA.encode_doc`) of shape ``(doc_len, dim)``.
+
+    Args:
+        max_size (int): maximum number of passages kept.
+        cache_encodings (bool): also keep the passage encodings.
+    """
+
+    def __init__(self, max_size, cache_encodings=False):
+        assert max_size > 0, "a DocCache needs a positive size"
+        self.max_size = max_size
+        self.cache_encodings = cache_encodings
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
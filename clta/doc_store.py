@@ -0,0 +1,106 @@
+import os
+import json
+import numpy as np
+import torch
+import CONSTANTS as CONST
+
+
+class DocEncodingStore(object):
+    """Precomputed DrQA passage encodings, memory-mapped from disk.
+
+    Passages are stored once and shared by all examples built from them.
+    ``path`` is a directory holding:
+
+    * ``meta.json``: ``use_qemb`` of the reader and encoding ``dim``
+    * ``doc_index.npy``: ``(num_examples,)`` passage slot of every example
+    * ``index.npy``: ``(num_docs + 1,)`` first token row of every passage
+    * ``ids.npy`` / ``offsets.npy``: vocabulary ids and character offsets
+      of every token
+    * ``encodings.npy``: ``(num_tokens, dim)`` float16 output of
+      :func:`DrQA.encode_doc`
+
+    Args:
+        path (str): directory written by :func:`precompute_doc_encodings`.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.path = path
+        self.use_qemb = meta['use_qemb']
+        self.dim = meta['dim']
+        self.doc_index = np.load(os.path.join(path, 'doc_index.npy'))
+        self.index = np.load(os.path.join(path, 'index.npy'))
+        self.ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.encodings = np.load(os.path.join(path, 'encodings.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.doc_index)
+
+    def __contains__(self, example_id):
+        return isinstance(example_id, int) and 0 <= example_id < len(self.doc_index)
+
+    def get(self, example_id, device=None, dtype=torch.float):
+        """Return the passage entry of ``example_id`` (see ``DocCache``)."""
+        slot = self.doc_index[example_id]
+        start, end = self.index[slot], self.index[slot + 1]
+        encoding = torch.from_numpy(np.array(self.encodings[start:end]))
+        return {'ids': self.ids[start:end].tolist(),
+                'offsets': [tuple(offset) for offset in self.offsets[start:end].tolist()],
+                'encoding': encoding.to(device=device, dtype=dtype)}
+
+
+def precompute_doc_encodings(drqa, docs, path, batch_size=32):
+    """Encode the passage of every example once and write a store to ``path``.
+
+    ``docs[i]`` is the passage text of example ``i``, joined the same way
+    as the reward queries of the trainer. Identical passages are encoded
+    once. The reader is run in eval mode without gradients.
+    """
+    slots = {}
+    unique_docs, doc_index = [], []
+    for doc in docs:
+        if doc not in slots:
+            slots[doc] = len(unique_docs)
+            unique_docs.append(doc)
+        doc_index.append(slots[doc])
+    tokenized = drqa._tokenize(unique_docs)
+    lengths = [len(ids) for ids, _ in tokenized]
+    index = np.zeros(len(unique_docs) + 1, dtype=np.int64)
+    index[1:] = np.cumsum(lengths)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    np.save(os.path.join(path, 'doc_index.npy'), np.array(doc_index, dtype=np.int64))
+    np.save(os.path.join(path, 'index.npy'), index)
+    np.save(os.path.join(path, 'ids.npy'),
+            np.array([i for ids, _ in tokenized for i in ids], dtype=np.int64))
+    np.save(os.path.join(path, 'offsets.npy'),
+            np.array([o for _, offsets in tokenized for o in offsets], dtype=np.int64).reshape(-1, 2))
+
+    pad = drqa.vocab.stoi[CONST.PAD_TOKEN]
+    encodings = None
+    training = drqa.training
+    drqa.train(False)
+    with torch.no_grad():
+        for start in range(0, len(unique_docs), batch_size):
+            batch = tokenized[start:start + batch_size]
+            doc_tensor, doc_lengths = drqa._to_padded_tensor([ids for ids, _ in batch], pad)
+            xd_mask = drqa._lengths_to_mask(doc_lengths, doc_tensor.size(1))
+            encoded = drqa.encode_doc(doc_tensor, xd_mask).cpu().half().numpy()
+            if encodings is None:
+                encodings = np.lib.format.open_memmap(
+                    os.path.join(path, 'encodings.npy'), mode='w+',
+                    dtype=np.float16, shape=(int(index[-1]), encoded.shape[-1]))
+            for j, (ids, _) in enumerate(batch):
+                row = index[start + j]
+                encodings[row:row + len(ids)] = encoded[j, :len(ids)]
+    drqa.train(training)
+    encodings.flush()
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'use_qemb': bool(drqa.args.use_qemb),
+                   'dim': int(encodings.shape[-1]),
+                   'num_docs': len(unique_docs),
+                   'num_examples': len(doc_index)}, f)
@@ -1,8 +1,10 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import json
 import logging
 import numpy as np
+from types import SimpleNamespace
 from tqdm import tqdm
 from .layers import SeqAttnMatch, StackedBRNN, LinearSeqAttn, BilinearSeqAttn
 from .layers import weighted_avg, uniform_weights, dropout
@@ -17,6 +19,20 @@ except Exception as e:
     logging.info("import error {}".format(str(e)))
 
 
+def build_drqa(vocab_path, config_path, param_path, gpu=False):
+    """Load a trained DrQA reader from its vocab, json config and params."""
+    vocab = torch.load(vocab_path)
+    with open(config_path, 'r') as f:
+        args = SimpleNamespace(**json.load(f))
+    drqa_model = DrQA(vocab, args)
+    drqa_model.load(param_path)
+    drqa_model.gpu = False
+    if gpu:
+        drqa_model = drqa_model.cuda()
+        drqa_model.gpu = True
+    return drqa_model
+
+
 def reverse(vocab, data):
     rep_str = []
     rep_list = []
@@ -44,6 +60,8 @@ class DrQA(nn.Module):
         self.gpu = False
         self.vocab = vocab
         self.vocab_size = len(vocab)
+        self.doc_cache = None
+        self.doc_store = None
         if self.vocab_size != args.vocab_size:
             logging.warn(
                     "required vocab_size is not equal to real vocab_size({} vs {})".format(
@@ -145,6 +163,40 @@ class DrQA(nn.Module):
         except Exception as e:
             print(e)
 
+    def encode_doc(self, batch_doc, xd_mask):
+        """Encode the question-independent part of a passage batch.
+
+        With ``use_qemb`` the document RNN reads question-aligned
+        embeddings, so only the word (and CoVe) embeddings of shape
+        ``(batch, max_d_len, word_embed)`` can be computed ahead of the
+        question. Without it the full ``doc_hiddens`` are returned.
+        """
+        xd_emb = self.w_embedding(batch_doc)                         # (batch, max_d_len, word_embed)
+        shared_axes = [2] if self.args.word_dropout else []
+        xd_emb = dropout(xd_emb, self.args.dropout_emb, shared_axes=shared_axes, training=self.training)
+        if self.mt_cove is not None:
+            xd_emb_cove = self.mt_cove(xd_emb, mask=xd_mask)
+            xd_emb = torch.cat([xd_emb, xd_emb_cove], -1)
+        if self.args.use_qemb:
+            return xd_emb
+        return self._encode_doc_rnn(xd_emb, xd_mask)
+
+    def _encode_doc_rnn(self, drnn_input, xd_mask):
+        # Project document to the same size as its encoder
+        if self.args.resize_rnn_input:
+            drnn_input = F.relu(self.doc_linear(drnn_input))
+            if self.args.dropout_ff > 0:
+                drnn_input = F.dropout(drnn_input, training=self.training)
+
+        # Encode document with RNN
+        doc_hiddens = self.doc_rnn(drnn_input, xd_mask)       # (batch, max_d_len, hidden_size)
+
+        # Document self attention
+        if self.args.doc_self_attn:
+            xd_weighted_emb = self.doc_self_attn(doc_hiddens, doc_hiddens, xd_mask)
+            doc_hiddens = torch.cat([doc_hiddens, xd_weighted_emb], 2)
+        return doc_hiddens
+
     def forward(self, **kwargs):
         if 'batch' in kwargs:
             batch = kwargs['batch']
@@ -159,14 +211,6 @@ class DrQA(nn.Module):
             batch_offsets = kwargs['context_offsets']
             batch_tgt = kwargs.get('targets')
 
-        # Embed both document and question
-        xq_emb = self.w_embedding(batch_que)                         # (batch, max_q_len, word_embed)
-        xd_emb = self.w_embedding(batch_doc)                         # (batch, max_d_len, word_embed)
-
-        shared_axes = [2] if self.args.word_dropout else []
-        xq_emb = dropout(xq_emb, self.args.dropout_emb, shared_axes=shared_axes, training=self.training)
-        xd_emb = dropout(xd_emb, self.args.dropout_emb, shared_axes=shared_axes, training=self.training)
-
         xd_mask = torch.ones_like(batch_doc, dtype=torch.uint8)
         for i, q in enumerate(doc_lengths):
             xd_mask[i, :q].fill_(0)
@@ -175,40 +219,33 @@ class DrQA(nn.Module):
         for i, q in enumerate(que_lengths):
             xq_mask[i, :q].fill_(0)
 
-        # -------------------------
-        if self.mt_cove is not None:
-            xq_emb_c = xq_emb
-            xd_emb_c = xd_emb
+        doc_encoding = kwargs.get('doc_encoding')
+        if doc_encoding is None:
+            doc_encoding = self.encode_doc(batch_doc, xd_mask)
 
-            xq_emb_cove = self.mt_cove(xq_emb_c, mask=xq_mask)
+        # Embed question
+        xq_emb = self.w_embedding(batch_que)                         # (batch, max_q_len, word_embed)
+        shared_axes = [2] if self.args.word_dropout else []
+        xq_emb = dropout(xq_emb, self.args.dropout_emb, shared_axes=shared_axes, training=self.training)
+        if self.mt_cove is not None:
+            xq_emb_cove = self.mt_cove(xq_emb, mask=xq_mask)
             xq_emb = torch.cat([xq_emb, xq_emb_cove], -1)
-            xd_emb_cove = self.mt_cove(xd_emb_c, mask=xd_mask)
-            xd_emb = torch.cat([xd_emb_c, xd_emb_cove], -1)
-        # ----------------------------
 
         # Add attention-weighted question representation
         if self.args.use_qemb:
+            xd_emb = doc_encoding
             xq_weighted_emb = self.qemb_match(xd_emb, xq_emb, xq_mask)
             drnn_input = torch.cat([xd_emb, xq_weighted_emb], 2)
+            doc_hiddens = self._encode_doc_rnn(drnn_input, xd_mask)
         else:
-            drnn_input = xd_emb
+            doc_hiddens = doc_encoding
 
-        # Project document and question to the same size as their encoders
+        # Project question to the same size as its encoder
         if self.args.resize_rnn_input:
-            drnn_input = F.relu(self.doc_linear(drnn_input))
             xq_emb = F.relu(self.q_linear(xq_emb))
             if self.args.dropout_ff > 0:
-                drnn_input = F.dropout(drnn_input, training=self.training)
                 xq_emb = F.dropout(xq_emb, training=self.training)
 
-        # Encode document with RNN
-        doc_hiddens = self.doc_rnn(drnn_input, xd_mask)       # (batch, max_d_len, hidden_size)
-
-        # Document self attention
-        if self.args.doc_self_attn:
-            xd_weighted_emb = self.doc_self_attn(doc_hiddens, doc_hiddens, xd_mask)
-            doc_hiddens = torch.cat([doc_hiddens, xd_weighted_emb], 2)
-
         # Encode question with RNN + merge hiddens
         question_hiddens = self.question_rnn(xq_emb, xq_mask)
         if self.args.question_merge == 'avg':
@@ -333,21 +370,34 @@ class DrQA(nn.Module):
         loss = F.nll_loss(score_s, targets[:, 0]) + F.nll_loss(score_e, targets[:, 1])
         return loss
 
-    def predict(self, doc, que, target=None):
+    def _tokenize(self, texts):
+        """Tokenize ``texts`` with spaCy; returns a list of (ids, offsets)."""
         global _NLP
         assert _NLP is not None, "_NLP is None, whether spacy is available?"
-        tokenized_doc = {'word': [], 'offsets': []}
-        tokenized_que = {'word': [], 'offsets': []}
-        for token in _NLP(doc):
-            tokenized_doc['word'].append(token.text)
-            tokenized_doc['offsets'].append((token.idx, token.idx + len(token.text)))
-        for token in _NLP(que):
-            tokenized_que['word'].append(token.text)
-            tokenized_que['offsets'].append((token.idx, token.idx + len(token.text)))
-
-        doc_ids = [self.vocab.stoi[w] for w in tokenized_doc['word']]
-        offsets = tokenized_doc['offsets']
-        que_ids = [self.vocab.stoi[w] for w in tokenized_que['word']]
+        tokenized = []
+        for tokens in _NLP.pipe(texts):
+            ids = [self.vocab.stoi[token.text] for token in tokens]
+            offsets = [(token.idx, token.idx + len(token.text)) for token in tokens]
+            tokenized.append((ids, offsets))
+        return tokenized
+
+    def _to_padded_tensor(self, seqs, pad):
+        """Right-pad ``seqs`` with ``pad`` into one LongTensor on the model device."""
+        max_len = max(len(seq) for seq in seqs)
+        data = [list(seq) + [pad] * (max_len - len(seq)) for seq in seqs]
+        device = self.w_embedding.weight.device
+        tensor = torch.tensor(data, dtype=torch.long, device=device)
+        lengths = torch.tensor([len(seq) for seq in seqs], dtype=torch.long, device=device)
+        return tensor, lengths
+
+    @staticmethod
+    def _lengths_to_mask(lengths, max_len):
+        """Padding mask (1 on padding) of shape ``(batch, max_len)``."""
+        positions = torch.arange(max_len, device=lengths.device).unsqueeze(0)
+        return positions.ge(lengths.unsqueeze(1)).to(torch.uint8)
+
+    def predict(self, doc, que, target=None):
+        (doc_ids, offsets), (que_ids, _) = self._tokenize([doc, que])
 
         doc_tensor = torch.tensor([doc_ids], dtype=torch.long)
         doc_length = torch.tensor([len(doc_ids)], dtype=torch.long)
@@ -371,3 +421,107 @@ class DrQA(nn.Module):
             results['f1'] = f1_score
 
         return results
+
+    def set_doc_cache(self, doc_cache):
+        self.doc_cache = doc_cache
+
+    def set_doc_store(self, doc_store):
+        assert doc_store.use_qemb == bool(self.args.use_qemb), \
+            "the passage store was encoded with use_qemb={}".format(doc_store.use_qemb)
+        self.doc_store = doc_store
+
+    def _lookup_docs(self, docs, doc_keys=None):
+        """Collect one entry (``ids``, ``offsets``) per distinct passage.
+
+        Passages are identified by ``doc_keys`` (e.g. example indices) or by
+        their text. Example indices are first looked up in the precomputed
+        passage store, then in the passage cache; passages are only
+        tokenized on a miss. Returns the distinct passages, their entries and, for every
+        element of ``docs``, the position of its entry.
+        """
+        if doc_keys is None:
+            doc_keys = docs
+        positions = {}
+        keys, unique_docs, doc_index = [], [], []
+        for key, doc in zip(doc_keys, docs):
+            if key not in positions:
+                positions[key] = len(keys)
+                keys.append(key)
+                unique_docs.append(doc)
+            doc_index.append(positions[key])
+
+        device = self.w_embedding.weight.device
+        entries = []
+        for key in keys:
+            if self.doc_store is not None and key in self.doc_store:
+                entries.append(self.doc_store.get(key, device=device))
+            elif self.doc_cache is not None:
+                entries.append(self.doc_cache.get(key))
+            else:
+                entries.append(None)
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        tokenized = self._tokenize([unique_docs[i] for i in missing])
+        for i, (ids, offsets) in zip(missing, tokenized):
+            entries[i] = {'ids': ids, 'offsets': offsets}
+            if self.doc_cache is not None:
+                self.doc_cache.put(keys[i], entries[i])
+        return unique_docs, entries, doc_index
+
+    def _encode_entries(self, entries, doc_tensor, xd_mask):
+        """``encode_doc`` for padded passages, reusing stored encodings."""
+        cache_encodings = self.doc_cache is not None and self.doc_cache.cache_encodings
+        missing = [i for i, entry in enumerate(entries) if 'encoding' not in entry]
+        if len(missing) == len(entries) and not cache_encodings:
+            return self.encode_doc(doc_tensor, xd_mask)
+        encodings = [entry.get('encoding') for entry in entries]
+        if missing:
+            max_len = max(len(entries[i]['ids']) for i in missing)
+            index = torch.tensor(missing, dtype=torch.long, device=doc_tensor.device)
+            encoded = self.encode_doc(doc_tensor.index_select(0, index)[:, :max_len],
+                                      xd_mask.index_select(0, index)[:, :max_len])
+            for j, i in enumerate(missing):
+                encodings[i] = encoded[j, :len(entries[i]['ids'])]
+                if cache_encodings:
+                    entries[i]['encoding'] = encodings[i].clone()
+        return nn.utils.rnn.pad_sequence(encodings, batch_first=True)
+
+    def predict_batch(self, docs, ques, targets=None, doc_keys=None):
+        """Answer ``ques[i]`` against ``docs[i]`` for all i in one forward pass.
+
+        Every distinct passage is tokenized and encoded once (see
+        ``doc_keys`` and :func:`_lookup_docs`). Passages and questions are
+        padded into single tensors, so the reader runs in eval mode (the
+        only mode in which ``StackedBRNN`` masks padding) and without
+        gradients; the previous mode is restored.
+        If ``targets`` is given, ``results['f1']`` holds one F1 per example.
+        """
+        assert len(docs) == len(ques), "one question per passage is required"
+        pad = self.vocab.stoi[CONST.PAD_TOKEN]
+        unique_docs, entries, doc_index = self._lookup_docs(docs, doc_keys)
+        que_ids = [ids for ids, _ in self._tokenize(ques)]
+
+        doc_tensor, doc_lengths = self._to_padded_tensor([entry['ids'] for entry in entries], pad)
+        que_tensor, que_lengths = self._to_padded_tensor(que_ids, pad)
+        max_doc_len = doc_tensor.size(1)
+        offsets_tensor = torch.tensor(
+            [list(entry['offsets']) + [(0, 0)] * (max_doc_len - len(entry['offsets'])) for entry in entries],
+            dtype=torch.long, device=doc_tensor.device)
+        xd_mask = self._lengths_to_mask(doc_lengths, max_doc_len)
+
+        index = torch.tensor(doc_index, dtype=torch.long, device=doc_tensor.device)
+        training = self.training
+        self.train(False)
+        with torch.no_grad():
+            doc_encoding = self._encode_entries(entries, doc_tensor, xd_mask)
+            results = self.forward(
+                question=(que_tensor, que_lengths),
+                context=(doc_tensor.index_select(0, index), doc_lengths.index_select(0, index),
+                         [unique_docs[i] for i in doc_index]),
+                context_offsets=offsets_tensor.index_select(0, index),
+                doc_encoding=doc_encoding.index_select(0, index))
+        self.train(training)
+        if targets is not None:
+            results['targets'] = targets
+            results['f1'] = [compute_eval_metric('f1', [prediction], [[target]])
+                             for prediction, target in zip(results['predictions'], targets)]
+        return results
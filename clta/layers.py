@@ -68,7 +68,7 @@ class StackedBRNN(nn.Module):
         """Slower (significantly), but more precise,
         encoding that handles padding."""
         # Compute sorted sequence lengths
-        lengths = x_mask.eq(0).long().sum(1).squeeze()
+        lengths = x_mask.eq(0).long().sum(1).view(-1)
         _, idx_sort = torch.sort(lengths, dim=0, descending=True)
         _, idx_unsort = torch.sort(idx_sort, dim=0)
 
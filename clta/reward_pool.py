@@ -0,0 +1,83 @@
+import os
+import torch
+import torch.multiprocessing as mp
+from .drqa_model import build_drqa
+from .doc_cache import DocCache
+from .doc_store import DocEncodingStore
+
+# DrQA reader of a worker process, set by _init_worker
+_DRQA = None
+
+
+def _init_worker(vocab_path, config_path, param_path, n_threads,
+                 cache_size, cache_encodings, doc_store):
+    global _DRQA
+    torch.set_num_threads(n_threads)
+    _DRQA = build_drqa(vocab_path, config_path, param_path, gpu=False)
+    if cache_size > 0:
+        _DRQA.set_doc_cache(DocCache(cache_size, cache_encodings))
+    if doc_store:
+        _DRQA.set_doc_store(DocEncodingStore(doc_store))
+
+
+def _score(docs, ques, targets, doc_keys):
+    return _DRQA.predict_batch(docs, ques, targets, doc_keys=doc_keys)['f1']
+
+
+class PendingRewards(object):
+    """Handle on the F1 scores of one :func:`RewardWorkerPool.submit`."""
+
+    def __init__(self, jobs):
+        self._jobs = jobs
+
+    def ready(self):
+        return all(job.ready() for job in self._jobs)
+
+    def get(self):
+        return [f1 for job in self._jobs for f1 in job.get()]
+
+
+class RewardWorkerPool(object):
+    """CPU processes answering reward queries with their own DrQA copy.
+
+    Every submitted batch of queries is split across the workers, which
+    run :func:`DrQA.predict_batch` while the trainer keeps going.
+
+    Args:
+        n_workers (int): number of worker processes.
+        vocab_path, config_path, param_path (str): see
+            :func:`clta.drqa_model.build_drqa`.
+        n_threads (int): intra-op threads per worker, by default the
+            cores are shared between the workers and the trainer.
+        cache_size, cache_encodings, doc_store: passage cache and store
+            of every worker, see ``-drqa_cache_size`` and friends.
+    """
+
+    def __init__(self, n_workers, vocab_path, config_path, param_path,
+                 n_threads=None, cache_size=0, cache_encodings=False,
+                 doc_store=None):
+        if n_threads is None:
+            n_threads = max(1, (os.cpu_count() or 1) // (n_workers + 1))
+        self.n_workers = n_workers
+        # spawn, so that workers never inherit a CUDA context
+        self._pool = mp.get_context('spawn').Pool(
+            n_workers, initializer=_init_worker,
+            initargs=(vocab_path, config_path, param_path, n_threads,
+                      cache_size, cache_encodings, doc_store))
+
+    def submit(self, docs, ques, targets, doc_keys=None):
+        """Queue the queries and return a :class:`PendingRewards`."""
+        if doc_keys is None:
+            doc_keys = docs
+        chunk = -(-len(docs) // self.n_workers)
+        jobs = []
+        for start in range(0, len(docs), chunk or 1):
+            end = start + chunk
+            jobs.append(self._pool.apply_async(
+                _score, (docs[start:end], ques[start:end],
+                         targets[start:end], doc_keys[start:end])))
+        return PendingRewards(jobs)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import codecs
+import multiprocessing
+import time
+
+import torch
+
 from onmt.utils.logging import init_logger
 from onmt.utils.misc import split_corpus
 from onmt.translate.translator import build_translator
@@ -9,12 +15,89 @@ from onmt.translate.translator import build_translator
 import onmt.opts as opts
 from onmt.utils.parse import ArgumentParser
 
+# set before the workers are forked, so they share the loaded model
+_translator = None
+_opt = None
+
+
+def _init_worker(n_threads):
+    torch.set_num_threads(n_threads)
+
+
+def _translate_unit(unit):
+    indices, src, history, tgt = unit
+    _, predictions = _translator.translate(
+        src=src,
+        history=history,
+        tgt=tgt,
+        src_dir=_opt.src_dir,
+        batch_size=_opt.batch_size,
+        attn_debug=_opt.attn_debug,
+        batch_type=_opt.batch_type)
+    return indices, predictions
+
+
+def _work_units(opt):
+    """Shards of the corpus, of examples of similar lengths with
+    ``-batch_type tokens``, with the indices of their examples."""
+    src = next(split_corpus(opt.src, 0))
+    history = next(split_corpus(opt.history, 0))
+    tgt = next(split_corpus(opt.tgt, 0)) if opt.tgt is not None else None
+    order = list(range(len(src)))
+    if opt.batch_type == "tokens":
+        order.sort(key=lambda i: (len(src[i].split()),
+                                  len(history[i].split())))
+    # a few units per worker when not sharded, to even out their load
+    size = opt.shard_size if opt.shard_size > 0 \
+        else max(1, -(-len(order) // (4 * opt.workers)))
+    for start in range(0, len(order), size):
+        indices = order[start:start + size]
+        yield (indices,
+               [src[i] for i in indices],
+               [history[i] for i in indices],
+               [tgt[i] for i in indices] if tgt is not None else None)
+
+
+def translate_with_workers(opt, translator, out_file, logger):
+    global _translator, _opt
+    _translator, _opt = translator, opt
+    # workers hand their predictions back, only this process writes
+    translator.out_file = None
+    n_threads = max(1, torch.get_num_threads() // opt.workers)
+    logger.info("Translating with %d workers of %d threads."
+                % (opt.workers, n_threads))
+
+    start_time = time.time()
+    pending, next_index = {}, 0
+    pool = multiprocessing.get_context("fork").Pool(
+        opt.workers, _init_worker, (n_threads,))
+    try:
+        for indices, predictions in pool.imap_unordered(
+                _translate_unit, _work_units(opt)):
+            pending.update(zip(indices, predictions))
+            while next_index in pending:
+                out_file.write('\n'.join(pending.pop(next_index)) + '\n')
+                next_index += 1
+            out_file.flush()
+    finally:
+        pool.close()
+        pool.join()
+    total_time = time.time() - start_time
+    logger.info("Translated %d sentences in %.1fs, %.2f sents/sec."
+                % (next_index, total_time,
+                   next_index / max(total_time, 1e-6)))
+
 
 def main(opt):
     ArgumentParser.validate_translate_opts(opt)
     logger = init_logger(opt.log_file)
 
-    translator = build_translator(opt, report_score=True)
+    out_file = codecs.open(opt.output, 'w+', 'utf-8')
+    translator = build_translator(opt, report_score=True, out_file=out_file)
+    if opt.workers > 1:
+        translate_with_workers(opt, translator, out_file, logger)
+        return
+
     src_shards = split_corpus(opt.src, opt.shard_size)
     history_shards = split_corpus(opt.history, opt.shard_size)
     tgt_shards = split_corpus(opt.tgt, opt.shard_size) \
@@ -29,7 +112,8 @@ def main(opt):
             tgt=opt.tgt,
             src_dir=opt.src_dir,
             batch_size=opt.batch_size,
-            attn_debug=opt.attn_debug)
+            attn_debug=opt.attn_debug,
+            batch_type=opt.batch_type)
 
 
 def _get_parser():
@@ -80,6 +80,9 @@ class RNNDecoderBase(DecoderBase):
         :class:`~onmt.modules.GlobalAttention`.
     """
 
+    # the attention takes one memory bank entry for several paths
+    shares_memory_bank = True
+
     def __init__(self, rnn_type, bidirectional_encoder, num_layers,
                  hidden_size, attn_type="general", attn_func="softmax",
                  coverage_attn=False, context_gate=None,
@@ -178,14 +181,43 @@ class RNNDecoderBase(DecoderBase):
         self.state["input_feed"] = \
             self.state["hidden"][0].data.new(*h_size).zero_().unsqueeze(0)
         self.state["coverage"] = None
+        self.state["attn_cache"] = None
 
     def map_state(self, fn):
         self.state["hidden"] = tuple(fn(h, 1) for h in self.state["hidden"])
         self.state["input_feed"] = fn(self.state["input_feed"], 1)
 
+    def map_memory_state(self, fn):
+        """Reorder the state kept per memory bank entry, as the memory
+        bank is reordered, which may be shared by several decoded paths.
+        """
+        if self.state.get("attn_cache") is not None:
+            self.state["attn_cache"] = {
+                name: {k: fn(v, 0) for k, v in cache.items()}
+                for name, cache in self.state["attn_cache"].items()}
+
     def detach_state(self):
         self.state["hidden"] = tuple(h.detach() for h in self.state["hidden"])
         self.state["input_feed"] = self.state["input_feed"].detach()
+        # truncated BPTT encodes the source again for the next chunk
+        self.state["attn_cache"] = None
+
+    def _attn_cache(self, memory_bank, memory_lengths):
+        """Precomputed memory bank parts of the attention modules.
+
+        Computed on the first call after :func:`init_state` and reordered
+        by :func:`map_memory_state`, so every decoding step of a batch
+        shares it.
+        """
+        if self.state.get("attn_cache") is None:
+            bank = memory_bank.transpose(0, 1)
+            cache = {}
+            if self.attentional:
+                cache["std"] = self.attn.precompute(bank, memory_lengths)
+            if self.copy_attn is not None:
+                cache["copy"] = self.copy_attn.precompute(bank)
+            self.state["attn_cache"] = cache
+        return self.state["attn_cache"]
 
     def forward(self, tgt, memory_bank, memory_lengths=None, step=None):
         """
@@ -292,10 +324,12 @@ class StdRNNDecoder(RNNDecoderBase):
         if not self.attentional:
             dec_outs = rnn_output
         else:
+            attn_cache = self._attn_cache(memory_bank, memory_lengths)
             dec_outs, p_attn = self.attn(
                 rnn_output.transpose(0, 1).contiguous(),
                 memory_bank.transpose(0, 1),
-                memory_lengths=memory_lengths
+                memory_lengths=memory_lengths,
+                cache=attn_cache["std"]
             )
             attns["std"] = p_attn
 
@@ -375,6 +409,7 @@ class InputFeedRNNDecoder(RNNDecoderBase):
         dec_state = self.state["hidden"]
         coverage = self.state["coverage"].squeeze(0) \
             if self.state["coverage"] is not None else None
+        attn_cache = self._attn_cache(memory_bank, memory_lengths)
 
         # Input feed concatenates hidden state with
         # input at every time step.
@@ -385,7 +420,8 @@ class InputFeedRNNDecoder(RNNDecoderBase):
                 decoder_output, p_attn = self.attn(
                     rnn_output,
                     memory_bank.transpose(0, 1),
-                    memory_lengths=memory_lengths)
+                    memory_lengths=memory_lengths,
+                    cache=attn_cache["std"])
                 attns["std"].append(p_attn)
             else:
                 decoder_output = rnn_output
@@ -407,7 +443,8 @@ class InputFeedRNNDecoder(RNNDecoderBase):
 
             if self.copy_attn is not None:
                 _, copy_attn = self.copy_attn(
-                    decoder_output, memory_bank.transpose(0, 1))
+                    decoder_output, memory_bank.transpose(0, 1),
+                    cache=attn_cache["copy"])
                 attns["copy"] += [copy_attn]
             elif self._reuse_copy_attn:
                 attns["copy"] = attns["std"]
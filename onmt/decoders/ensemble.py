@@ -77,6 +77,10 @@ class EnsembleDecoder(nn.Module):
         for model_decoder in self.model_decoders:
             model_decoder.map_state(fn)
 
+    def map_memory_state(self, fn):
+        for model_decoder in self.model_decoders:
+            model_decoder.map_memory_state(fn)
+
 
 class EnsembleGenerator(nn.Module):
     """
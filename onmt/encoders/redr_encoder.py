@@ -1,10 +1,25 @@
 """Define RNN-based encoders."""
+from concurrent.futures import ThreadPoolExecutor
+
 import torch
 import torch.nn as nn
 from torch.nn.parameter import Parameter
+from torch.nn.utils.rnn import pack_padded_sequence as pack
+from torch.nn.utils.rnn import pad_packed_sequence as unpack
 
 from onmt.encoders.encoder import EncoderBase
 from onmt.encoders.rnn_encoder import RNNEncoder
+from onmt.utils.misc import sequence_mask
+
+
+# single-worker pools running the history branch, by intra-op thread count
+_BRANCH_EXECUTORS = {}
+
+
+def _branch_executor(n_threads):
+    if n_threads not in _BRANCH_EXECUTORS:
+        _BRANCH_EXECUTORS[n_threads] = ThreadPoolExecutor(max_workers=1)
+    return _BRANCH_EXECUTORS[n_threads]
 
 
 class BaseRNN(nn.Module):
@@ -44,26 +59,31 @@ class EncoderRNN(BaseRNN):
                                  batch_first=True, bidirectional=bidirectional, dropout=dropout_p)
 
     def forward(self, embedded, input_lengths=None):
+        """Run the RNN over ``embedded`` of shape ``(batch, len, input_size)``.
+
+        With ``input_lengths`` the padded steps are packed away; the
+        longest length must be ``len``, as in batches padded to their
+        longest sequence.
+        """
         if input_lengths is None:
             output, hidden = self.rnn(embedded)
         else:
-            _, idx_sort = torch.sort(input_lengths, dim=0, descending=True)
+            sorted_lengths, idx_sort = torch.sort(input_lengths, dim=0, descending=True)
             _, idx_unsort = torch.sort(idx_sort, dim=0)
 
-            input_lengths = list(input_lengths[idx_sort])
+            embedded = self.input_dropout(embedded.index_select(0, idx_sort))
+            # lengths stay a tensor, so that a traced encoder keeps them dynamic
+            embedded = pack(embedded, sorted_lengths.view(-1).cpu(), batch_first=True)
 
-            embedded = self.input_dropout(embedded)
-            embedded = nn.utils.rnn.pack_padded_sequence(embedded, input_lengths, batch_first=True)
-
-            if not self._bidirectional:
-                output, hidden = self.rnn(embedded)
-            else:
-                output, (hidden, _) = self.rnn(embedded)
+            output, hidden = self.rnn(embedded)
 
-            output, _ = nn.utils.rnn.pad_packed_sequence(output, batch_first=True)
+            output, _ = unpack(output, batch_first=True)
 
             output = output.index_select(0, idx_unsort)
-            hidden = hidden.index_select(1, idx_unsort)
+            if isinstance(hidden, tuple):  # LSTM
+                hidden = tuple(h.index_select(1, idx_unsort) for h in hidden)
+            else:
+                hidden = hidden.index_select(1, idx_unsort)
         return output, hidden
 
 
@@ -86,56 +106,72 @@ class ReDRLayer(nn.Module):
             rnn_cell=rnn_type,
             max_len=max_len)
 
-    def forward(self, doc_encoder_hidden, que_encoder_hidden, doc_encoder_outputs, que_encoder_outputs):
-        # ------------
-        if isinstance(doc_encoder_hidden, tuple):
-            doc_encoder_hidden = doc_encoder_hidden[0][-1, :, :].unsqueeze(0)
-        if isinstance(que_encoder_hidden, tuple):
-            que_encoder_hidden = que_encoder_hidden[0][-1, :, :].unsqueeze(0)
-        if que_encoder_hidden.size(0) != 1:
-            # get the last layer
-            que_encoder_hidden = que_encoder_outputs[-1, :, :].unsqueeze(0)
-        doc_encoder_outputs = doc_encoder_outputs.transpose(0, 1)
-        que_encoder_outputs = que_encoder_outputs.transpose(0, 1)
-        batch_size = doc_encoder_outputs.size(0)
-        gates = None
-        nm_layers = self.n_memory_layers
+    def forward(self, doc_encoder_hidden, que_encoder_hidden, doc_encoder_outputs, que_encoder_outputs,
+                doc_lengths=None, que_lengths=None):
+        """Run the memory hops over the passage and the history.
+
+        The gate projections ``_w_u``, ``_w_c`` and ``_w_r`` are applied as
+        two products, one over ``U`` and one over the merge encoder input
+        ``[R; G]``, and both attention directions are normalized from the
+        same alignment matrix, so no transposed copy is made.
+
+        When lengths are given, padded positions get no attention in
+        either direction and the merge encoder packs them away.
+
+        Args:
+            doc_encoder_outputs (FloatTensor): ``(n, batch, hidden)``.
+            que_encoder_outputs (FloatTensor): ``(m, batch, hidden)``.
+            doc_lengths (LongTensor): passage lengths ``(batch,)``.
+            que_lengths (LongTensor): history lengths ``(batch,)``.
+
+        Returns:
+            (FloatTensor, FloatTensor):
+
+            * last hidden state of the merge encoder
+            * passage encoding ``(batch, n, hidden)``
+        """
         # batch * n * d
-        _R = doc_encoder_outputs
+        _R = doc_encoder_outputs.transpose(0, 1)
         # batch * m * d
-        _C = que_encoder_outputs
-        for i in range(nm_layers):
-            # alignment matrix S = R^T C
-            # que_encoder_output is context, history C_m
+        _C = que_encoder_outputs.transpose(0, 1)
+        # padding masks: batch * n * 1 and batch * 1 * m
+        doc_pad = None if doc_lengths is None else \
+            sequence_mask(doc_lengths, max_len=_R.size(1)).eq(0).unsqueeze(2)
+        que_pad = None if que_lengths is None else \
+            sequence_mask(que_lengths, max_len=_C.size(1)).eq(0).unsqueeze(1)
+        # gate weights in the order of [U; R; G]
+        w_rc = torch.cat((self._w_r, self._w_c), 0)
+        encoder_hidden = None
+        for i in range(self.n_memory_layers):
+            # alignment matrix S = R^T C: batch * n * m
             _S = torch.bmm(_R, _C.transpose(1, 2))
-            # _S: B x l_doc x l_que
-            # cq: B x hidden_size x l_que
-            _H = torch.bmm(_R.transpose(1, 2), torch.softmax(_S, dim=-1))
-            _G0 = torch.cat((_C.transpose(1, 2), _H), dim=1)  # B x 2*hidden_size x m
-            _G = torch.bmm(_G0, torch.softmax(_S.transpose(1, 2), dim=-1))  # B x 2*hidden_size x n
-            u_inp = torch.cat((_R, _G.transpose(1, 2)), dim=-1)  # l_doc x B x 3*hidden_size
-            # U: n * batch * hidden
-            u_outputs, u_hidden = self.merge_encoder(u_inp)
-            # n_layers * direction, batch_size, hidden_size
-            encoder_hidden = u_hidden
+            # attention of every passage word over the history
+            _S_que, _S_doc = _S, _S
+            if que_pad is not None:
+                _S_que = _S.masked_fill(que_pad, -float('inf'))
+            _A_que = torch.softmax(_S_que, dim=-1)
+            if doc_pad is not None:
+                _A_que = _A_que.masked_fill(doc_pad, 0)
+                _S_doc = _S.masked_fill(doc_pad, -float('inf'))
+            # attention of every history word over the passage
+            _A_doc = torch.softmax(_S_doc, dim=1)
+            if que_pad is not None:
+                _A_doc = _A_doc.masked_fill(que_pad, 0)
+            # H^T = softmax_m(S)^T R: batch * m * d
+            _H = torch.bmm(_A_que.transpose(1, 2), _R)
+            # G^T = softmax_n(S) [C; H^T]: batch * n * 2d
+            _G = torch.bmm(_A_doc, torch.cat((_C, _H), dim=-1))
+            u_inp = torch.cat((_R, _G), dim=-1)  # batch * n * 3d
+            # U: batch * n * d
+            u_outputs, encoder_hidden = self.merge_encoder(u_inp, doc_lengths)
 
             if i == 0:
                 _R = u_outputs
             else:
-                # U, G, R: batch * n * d/2d
-                item_a = torch.mm(u_outputs.contiguous().view(-1, self.hidden_size), self._w_u)\
-                              .contiguous()\
-                              .view(batch_size, -1)
-                item_b = torch.mm(_G.transpose(1, 2).contiguous().view(-1, 2 * self.hidden_size), self._w_c)\
-                              .contiguous()\
-                              .view(batch_size, -1)
-                item_c = torch.mm(_R.contiguous().view(-1, self.hidden_size), self._w_r)\
-                              .contiguous()\
-                              .view(batch_size, -1)
-                gates = torch.sigmoid((item_a + item_b + item_c + self._b))
-                gates = gates.unsqueeze(-1)
-                gated_u = gates * _R + (1 - gates) * u_outputs
-                _R = gated_u
+                # batch * n * 1
+                gates = torch.sigmoid(
+                    u_outputs.matmul(self._w_u) + u_inp.matmul(w_rc) + self._b)
+                _R = gates * _R + (1 - gates) * u_outputs
 
         return encoder_hidden, _R
 
@@ -151,6 +187,7 @@ class ReDREncoder(EncoderBase):
         self.history_encoder = RNNEncoder(
                 rnn_type, bidirectional, num_layers, hidden_size, dropout, embeddings, use_bridge)
         self.redr_layer = ReDRLayer(hidden_size, rnn_type, num_layers=num_layers, n_memory_layers=n_memory_layers)
+        self.branch_threads = 0
 
     @classmethod
     def from_opt(cls, opt, embeddings):
@@ -165,9 +202,46 @@ class ReDREncoder(EncoderBase):
             opt.bridge,
             opt.n_memory_layers)
 
-    def forward(self, src, history, src_lengths=None, history_lengths=None):
-        enc_state, memory_bank, src_lengths = self.reference_encoder(src, src_lengths)
-        history_enc_state, history_memory_bank, history_lengths = self.history_encoder(history, history_lengths, resort=True)
-        enc_hidden, src_enc_outputs = self.redr_layer(enc_state, history_enc_state, memory_bank, history_memory_bank)
+    def set_branch_threads(self, n_threads):
+        """Encode the history concurrently with the passage.
+
+        The history branch runs in a worker thread using ``n_threads``
+        intra-op threads, the passage branch keeps the threads of the
+        caller. ``0`` runs the branches one after the other.
+        """
+        self.branch_threads = n_threads
+
+    def _encode_history(self, history, history_lengths, grad_enabled=True):
+        # grad mode and the intra-op thread count are per thread
+        if self.branch_threads > 0 and torch.get_num_threads() != self.branch_threads:
+            torch.set_num_threads(self.branch_threads)
+        with torch.set_grad_enabled(grad_enabled):
+            return self.history_encoder(history, history_lengths, resort=True)
+
+    def encode_passage(self, src, src_lengths=None):
+        """Encode the passage alone, which does not depend on the history.
+
+        Returns:
+            ``(enc_state, memory_bank, lengths)`` to pass back as
+            ``passage`` to :func:`forward()` for any history.
+        """
+        return self.reference_encoder(src, src_lengths)
+
+    def forward(self, src, history, src_lengths=None, history_lengths=None,
+                passage=None):
+        if passage is not None:
+            enc_state, memory_bank, src_lengths = passage
+            history_enc_state, history_memory_bank, history_lengths = self._encode_history(history, history_lengths)
+        elif self.branch_threads > 0:
+            history_out = _branch_executor(self.branch_threads).submit(
+                self._encode_history, history, history_lengths,
+                torch.is_grad_enabled())
+            enc_state, memory_bank, src_lengths = self.reference_encoder(src, src_lengths)
+            history_enc_state, history_memory_bank, history_lengths = history_out.result()
+        else:
+            enc_state, memory_bank, src_lengths = self.reference_encoder(src, src_lengths)
+            history_enc_state, history_memory_bank, history_lengths = self._encode_history(history, history_lengths)
+        enc_hidden, src_enc_outputs = self.redr_layer(enc_state, history_enc_state, memory_bank, history_memory_bank,
+                                                      src_lengths, history_lengths)
         src_enc_outputs = src_enc_outputs.transpose(0, 1)
         return enc_state, src_enc_outputs, src_lengths
@@ -71,9 +71,9 @@ class RNNEncoder(EncoderBase):
         if not resort:
             packed_emb = emb
             if lengths is not None and not self.no_pack_padded_seq:
-                # Lengths data is wrapped inside a Tensor.
-                lengths_list = lengths.view(-1).tolist()
-                packed_emb = pack(emb, lengths_list)
+                # Lengths data is wrapped inside a Tensor, kept as one so
+                # that a traced encoder handles any lengths.
+                packed_emb = pack(emb, lengths.view(-1).cpu())
 
             memory_bank, encoder_final = self.rnn(packed_emb)
             if lengths is not None and not self.no_pack_padded_seq:
@@ -81,22 +81,22 @@ class RNNEncoder(EncoderBase):
 
         else:
 
-            _, idx_sort = torch.sort(lengths, dim=0, descending=True)
+            sorted_lengths, idx_sort = torch.sort(lengths, dim=0, descending=True)
             _, idx_unsort = torch.sort(idx_sort, dim=0)
 
-            input_lengths = list(lengths[idx_sort])
+            input_lengths = sorted_lengths.view(-1).cpu()
 
-            embedded = nn.utils.rnn.pack_padded_sequence(emb, input_lengths, batch_first=False)
+            embedded = pack(emb.index_select(1, idx_sort), input_lengths)
 
-            # if self.num_directions == 1:
-            #     output, hidden = self.rnn(embedded)
-            # else:
-            output, (hidden, _) = self.rnn(embedded)
+            output, hidden = self.rnn(embedded)
 
-            output, _ = nn.utils.rnn.pad_packed_sequence(output, batch_first=False)
+            output, _ = unpack(output)
 
             output = output.index_select(1, idx_unsort)
-            hidden = hidden.index_select(1, idx_unsort)
+            if isinstance(hidden, tuple):  # LSTM
+                hidden = tuple(h.index_select(1, idx_unsort) for h in hidden)
+            else:
+                hidden = hidden.index_select(1, idx_unsort)
             memory_bank = output
             encoder_final = hidden
 
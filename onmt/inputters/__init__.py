@@ -5,7 +5,8 @@ e.g., from a line of text to a sequence of embeddings.
 """
 from onmt.inputters.inputter import \
     load_old_vocab, get_fields, OrderedIterator, \
-    build_vocab, old_style_vocab, filter_example
+    build_vocab, old_style_vocab, filter_example, \
+    src_history_sort_key, max_src_history_tok_len
 from onmt.inputters.dataset_base import Dataset
 from onmt.inputters.text_dataset import text_sort_key, TextDataReader
 from onmt.inputters.datareader_base import DataReaderBase
@@ -19,4 +20,5 @@ str2sortkey = {
 
 __all__ = ['Dataset', 'load_old_vocab', 'get_fields', 'DataReaderBase',
            'filter_example', 'old_style_vocab', 'build_vocab',
-           'OrderedIterator', 'text_sort_key', 'TextDataReader']
+           'OrderedIterator', 'text_sort_key', 'TextDataReader',
+           'src_history_sort_key', 'max_src_history_tok_len']
@@ -645,6 +645,28 @@ def max_tok_len(new, count, sofar):
     return max(src_elements, tgt_elements)
 
 
+def src_history_sort_key(ex):
+    """Sort by passage length, then conversation history length."""
+    return len(ex.src[0]), len(ex.history[0])
+
+
+def max_src_history_tok_len(new, count, sofar):
+    """
+    In token batching scheme for generation, the number of examples is
+    limited such that the total number of src and history tokens
+    (including padding) in a batch <= batch_size
+    """
+    # Maintains the longest src and history length in the current batch
+    global max_src_in_batch, max_history_in_batch  # this is a hack
+    # Reset current longest length at a new batch (count=1)
+    if count == 1:
+        max_src_in_batch = 0
+        max_history_in_batch = 0
+    max_src_in_batch = max(max_src_in_batch, len(new.src[0]))
+    max_history_in_batch = max(max_history_in_batch, len(new.history[0]))
+    return count * (max_src_in_batch + max_history_in_batch)
+
+
 def build_dataset_iter(corpus_type, fields, opt, is_train=True):
     """
     This returns user-defined train/validate data iterator for the trainer
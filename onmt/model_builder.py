@@ -4,8 +4,6 @@ and creates each encoder and decoder accordingly.
 """
 import re
 import torch
-import json
-from types import SimpleNamespace
 import torch.nn as nn
 from torch.nn.init import xavier_uniform_
 
@@ -20,7 +18,7 @@ from onmt.modules.util_class import Cast
 from onmt.utils.misc import use_gpu
 from onmt.utils.logging import logger
 from onmt.utils.parse import ArgumentParser
-from clta.drqa_model import DrQA
+from onmt.models.scripted import is_scripted_model, load_scripted_model
 
 
 def build_embeddings(opt, text_field, for_encoder=True):
@@ -84,6 +82,14 @@ def build_decoder(opt, embeddings):
 def load_test_model(opt, model_path=None):
     if model_path is None:
         model_path = opt.models[0]
+    if is_scripted_model(model_path):
+        map_location = "cuda" if use_gpu(opt) else "cpu"
+        fields, model, model_opt = load_scripted_model(model_path,
+                                                       map_location)
+        if opt.fp32:
+            model.float()
+        model.eval()
+        return fields, model, model_opt
     checkpoint = torch.load(model_path,
                             map_location=lambda storage, loc: storage)
 
@@ -100,13 +106,29 @@ def load_test_model(opt, model_path=None):
 
     model = build_base_model(model_opt, opt, fields, use_gpu(opt), checkpoint,
                              opt.gpu)
-    if opt.fp32:
+    quantize = getattr(opt, 'quantize', None) or checkpoint.get('quantize')
+    if opt.fp32 or quantize:
         model.float()
     model.eval()
     model.generator.eval()
+    if quantize:
+        assert not use_gpu(opt), "Quantized models only run on CPU"
+        model = quantize_model(model, quantize)
     return fields, model, model_opt
 
 
+def quantize_model(model, dtype="int8"):
+    """Dynamically quantize the recurrent and linear layers of ``model``.
+
+    Weights are stored in ``dtype`` and activations quantized on the fly,
+    for CPU inference. Returns a quantized copy of ``model``.
+    """
+    assert dtype == "int8", "Only int8 quantization is supported"
+    layers = {nn.LSTM, nn.GRU, nn.LSTMCell, nn.GRUCell, nn.Linear}
+    return torch.quantization.quantize_dynamic(model, layers,
+                                               dtype=torch.qint8)
+
+
 def build_base_model(model_opt, opt, fields, gpu, checkpoint=None, gpu_id=None):
     """Build a model from opts.
 
@@ -231,16 +253,19 @@ def build_model(model_opt, opt, fields, checkpoint):
     model = build_base_model(model_opt, opt, fields, use_gpu(opt), checkpoint)
     # drqa model
     drqa_model = None
-    if opt.enable_rl_after >= 0:
-        vocab = torch.load(opt.drqa_vocab_path)
-        json_config = json.load(open(opt.drqa_config_path, 'r'))
-        args = SimpleNamespace(**json_config)
-        drqa_model = DrQA(vocab, args)
-        drqa_model.load(opt.drqa_param_path)
-        drqa_model.gpu = False
-        if use_gpu(opt):
-            drqa_model = drqa_model.cuda()
-            drqa_model.gpu = True
+    if opt.enable_rl_after >= 0 and opt.rl_reward_workers <= 0:
+        # only training with rewards needs the reader and spaCy, the
+        # workers of -rl_reward_workers load their own
+        from clta.drqa_model import build_drqa
+        from clta.doc_cache import DocCache
+        from clta.doc_store import DocEncodingStore
+        drqa_model = build_drqa(opt.drqa_vocab_path, opt.drqa_config_path,
+                                opt.drqa_param_path, gpu=use_gpu(opt))
+        if opt.drqa_cache_size > 0:
+            drqa_model.set_doc_cache(
+                DocCache(opt.drqa_cache_size, opt.drqa_cache_encodings))
+        if opt.drqa_doc_store:
+            drqa_model.set_doc_store(DocEncodingStore(opt.drqa_doc_store))
     model.set_drqa_model(drqa_model)
     # -----
     logger.info(model)
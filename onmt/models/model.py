@@ -39,7 +39,12 @@ class NMTModel(nn.Module):
         results = self.drqa_model.predict(doc=doc, que=que, target=target)
         return results
 
-    def forward(self, batch, src, history, tgt, src_lengths, history_lengths, bptt=False):
+    def drqa_predict_batch(self, docs, ques, targets, doc_keys=None):
+        results = self.drqa_model.predict_batch(docs=docs, ques=ques, targets=targets, doc_keys=doc_keys)
+        return results
+
+    def forward(self, batch, src, history, tgt, src_lengths, history_lengths, bptt=False, translate=True,
+                keep_dec_outputs=True):
         """Forward propagate a `src` and `tgt` pair for training.
         Possible initialized with a beginning decoder state.
 
@@ -52,6 +57,11 @@ class NMTModel(nn.Module):
             lengths(LongTensor): The src lengths, pre-padding ``(batch,)``.
             bptt (Boolean): A flag indicating if truncated bptt is set.
                 If reset then init_state
+            translate (Boolean): Also decode ``batch`` with the translator.
+                If unset the returned results are None
+            keep_dec_outputs (Boolean): Keep the decoder outputs of the
+                search with their graph, see
+                :func:`onmt.translate.Translator.translate_batch()`
 
         Returns:
             (FloatTensor, dict[str, FloatTensor]):
@@ -68,6 +78,12 @@ class NMTModel(nn.Module):
 
         dec_out, attns = self.decoder(tgt, memory_bank,
                                       memory_lengths=src_lengths)
-        vocabs = self.trainset_vocabs if self.train() else self.devset_vocabs
-        results = self.translator.translate_batch(batch, vocabs, False, training=self.train())
+        if not translate:
+            return dec_out, attns, None
+        vocabs = self.trainset_vocabs if self.training else self.devset_vocabs
+        # the search starts from the encoding computed above
+        results = self.translator.translate_batch(
+            batch, vocabs, False, training=self.training,
+            enc_out=(enc_state, memory_bank, src_lengths),
+            keep_dec_outputs=keep_dec_outputs and self.training)
         return dec_out, attns, results
@@ -0,0 +1,231 @@
+"""TorchScript export of a trained model and the wrappers to decode with it.
+
+The exported archive holds a traced module with three methods:
+
+* ``encode(src, history, src_lengths, history_lengths)`` returns the
+  initial decoder hidden state, stacked to
+  ``(n_states, layers, batch, hidden)``, and the memory bank.
+* ``decode_step(tgt, memory_bank, memory_lengths, hidden, input_feed)``
+  runs the decoder for one step with its state passed explicitly and
+  returns the output, the standard and copy attentions and the new state.
+* ``generate(...)`` applies the generator, ``(dec_out, attn, src_map)``
+  for a :class:`onmt.modules.CopyGenerator`, ``(dec_out,)`` otherwise.
+
+The fields and the model options are stored next to the code, so
+:func:`load_scripted_model` needs neither the checkpoint nor the
+training code.
+"""
+import io
+import zipfile
+
+import torch
+import torch.nn as nn
+
+from onmt.decoders.decoder import InputFeedRNNDecoder
+
+
+class _TracedModel(nn.Module):
+    """The methods traced by :func:`export_model`."""
+
+    def __init__(self, model):
+        super(_TracedModel, self).__init__()
+        self.encoder = model.encoder
+        self.decoder = model.decoder
+        self.generator = model.generator
+
+    def encode(self, src, history, src_lengths, history_lengths):
+        enc_state, memory_bank, _ = self.encoder(
+            src, history, src_lengths, history_lengths)
+        self.decoder.init_state(src, memory_bank, enc_state)
+        return torch.stack(self.decoder.state["hidden"]), memory_bank
+
+    def decode_step(self, tgt, memory_bank, memory_lengths, hidden,
+                    input_feed):
+        self.decoder.state["hidden"] = tuple(
+            hidden[i] for i in range(hidden.size(0)))
+        self.decoder.state["input_feed"] = input_feed
+        self.decoder.state["coverage"] = None
+        # traced inline, projections of the memory bank included
+        self.decoder.state["attn_cache"] = None
+        dec_out, attns = self.decoder(
+            tgt, memory_bank, memory_lengths=memory_lengths)
+        return (dec_out, attns["std"], attns.get("copy", attns["std"]),
+                torch.stack(self.decoder.state["hidden"]),
+                self.decoder.state["input_feed"])
+
+    def generate(self, *args):
+        return self.generator(*args)
+
+
+def _example_inputs(model, model_opt, fields, device):
+    """Small random inputs reaching every traced code path."""
+    src_vocab = fields["src"].base_field.vocab
+    tgt_vocab = fields["tgt"].base_field.vocab
+    batch_size, src_len, history_len = 2, 7, 5
+    src = torch.randint(len(src_vocab), (src_len, batch_size, 1),
+                        dtype=torch.long, device=device)
+    history = torch.randint(len(src_vocab), (history_len, batch_size, 1),
+                            dtype=torch.long, device=device)
+    src_lengths = torch.tensor([src_len, src_len - 2], device=device)
+    # unsorted, as the history encoder sorts its own batch
+    history_lengths = torch.tensor([history_len - 2, history_len],
+                                   device=device)
+    encode = (src, history, src_lengths, history_lengths)
+    with torch.no_grad():
+        hidden, memory_bank = _TracedModel(model).encode(*encode)
+    tgt = torch.randint(len(tgt_vocab), (1, batch_size, 1),
+                        dtype=torch.long, device=device)
+    input_feed = memory_bank.new_zeros(1, batch_size, model_opt.dec_rnn_size)
+    decode_step = (tgt, memory_bank, src_lengths, hidden, input_feed)
+    dec_out = memory_bank.new_zeros(batch_size, model_opt.dec_rnn_size)
+    if model_opt.copy_attn:
+        attn = memory_bank.new_full((batch_size, src_len), 1.0 / src_len)
+        src_map = memory_bank.new_zeros(src_len, batch_size, 4)
+        src_map[torch.arange(src_len), :, torch.arange(src_len) % 4] = 1
+        generate = (dec_out, attn, src_map)
+    else:
+        generate = (dec_out,)
+    return {"encode": encode, "decode_step": decode_step,
+            "generate": generate}
+
+
+def export_model(model, fields, model_opt, path):
+    """Trace ``model`` (in eval mode) and save it to ``path``."""
+    assert isinstance(model.decoder, InputFeedRNNDecoder), \
+        "Only the input feed RNN decoder can be exported"
+    assert model.decoder.attentional and not model_opt.coverage_attn, \
+        "Exported decoders need attention and no coverage"
+    if hasattr(model.encoder, "set_branch_threads"):
+        # the history branch is traced inline
+        model.encoder.set_branch_threads(0)
+    device = next(model.parameters()).device
+    inputs = _example_inputs(model, model_opt, fields, device)
+    with torch.no_grad():
+        traced = torch.jit.trace_module(_TracedModel(model), inputs)
+    extra_files = {}
+    for name, obj in (("fields.pt", fields), ("opt.pt", model_opt)):
+        buf = io.BytesIO()
+        torch.save(obj, buf)
+        extra_files[name] = buf.getvalue()
+    torch.jit.save(traced, path, _extra_files=extra_files)
+
+
+def is_scripted_model(path):
+    """Whether ``path`` is a TorchScript archive rather than a checkpoint."""
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any(name.startswith("code/") or "/code/" in name
+                   for name in archive.namelist())
+
+
+def load_scripted_model(path, map_location=None):
+    """Load an archive written by :func:`export_model`.
+
+    Returns:
+        (dict, ScriptedNMTModel, argparse.Namespace): fields, model
+        and the options of the exported model.
+    """
+    extra_files = {"fields.pt": "", "opt.pt": ""}
+    module = torch.jit.load(path, map_location=map_location,
+                            _extra_files=extra_files)
+    fields = torch.load(io.BytesIO(extra_files["fields.pt"]))
+    model_opt = torch.load(io.BytesIO(extra_files["opt.pt"]))
+    return fields, ScriptedNMTModel(module, model_opt), model_opt
+
+
+class ScriptedEncoder(object):
+    def __init__(self, module):
+        self.module = module
+
+    def set_branch_threads(self, n_threads):
+        """Branches of an exported encoder always run one after the other."""
+
+    def __call__(self, src, history, src_lengths=None, history_lengths=None):
+        hidden, memory_bank = self.module.encode(
+            src, history, src_lengths, history_lengths)
+        return hidden, memory_bank, src_lengths
+
+
+class ScriptedDecoder(object):
+    """Decoder state kept in Python around the traced ``decode_step``.
+
+    Mirrors the :class:`onmt.decoders.decoder.RNNDecoderBase` interface
+    used by the translator, the hidden state being stacked as returned
+    by ``encode``.
+    """
+
+    attentional = True
+
+    def __init__(self, module, hidden_size):
+        self.module = module
+        self.hidden_size = hidden_size
+        self.state = {}
+
+    def init_state(self, src, memory_bank, encoder_final):
+        self.state["hidden"] = encoder_final
+        self.state["input_feed"] = memory_bank.new_zeros(
+            1, encoder_final.size(2), self.hidden_size)
+
+    def map_state(self, fn):
+        self.state["hidden"] = fn(self.state["hidden"], 2)
+        self.state["input_feed"] = fn(self.state["input_feed"], 1)
+
+    def map_memory_state(self, fn):
+        """The memory bank is the only per memory bank entry state."""
+
+    def detach_state(self):
+        self.state["hidden"] = self.state["hidden"].detach()
+        self.state["input_feed"] = self.state["input_feed"].detach()
+
+    def __call__(self, tgt, memory_bank, memory_lengths=None, step=None):
+        dec_outs, std, copy = [], [], []
+        for tgt_t in tgt.split(1):
+            dec_out, attn, copy_attn, hidden, input_feed = \
+                self.module.decode_step(
+                    tgt_t, memory_bank, memory_lengths,
+                    self.state["hidden"], self.state["input_feed"])
+            self.state["hidden"] = hidden
+            self.state["input_feed"] = input_feed
+            dec_outs.append(dec_out)
+            std.append(attn)
+            copy.append(copy_attn)
+        return torch.cat(dec_outs), {"std": torch.cat(std),
+                                     "copy": torch.cat(copy)}
+
+
+class ScriptedGenerator(object):
+    def __init__(self, module):
+        self.module = module
+
+    def eval(self):
+        return self
+
+    def __call__(self, *args):
+        return self.module.generate(*args)
+
+
+class ScriptedNMTModel(object):
+    """Stands in for :class:`onmt.models.NMTModel` at translation time."""
+
+    def __init__(self, module, model_opt):
+        self.module = module
+        self.encoder = ScriptedEncoder(module)
+        self.decoder = ScriptedDecoder(module, model_opt.dec_rnn_size)
+        self.generator = ScriptedGenerator(module)
+
+    def eval(self):
+        self.module.eval()
+        return self
+
+    def float(self):
+        self.module.float()
+        return self
+
+    def cpu(self):
+        self.module.cpu()
+        return self
+
+    def cuda(self):
+        self.module.cuda()
+        return self
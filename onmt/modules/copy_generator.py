@@ -1,36 +1,80 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from onmt.utils.misc import aeq
 from onmt.utils.loss import LossComputeBase
 
 
-def collapse_copy_scores(scores, batch, tgt_vocab, src_vocabs,
-                         batch_dim=1, batch_offset=None):
+def _collapse_index(batch, tgt_vocab, src_vocabs):
     """
-    Given scores from an expanded dictionary
-    corresponeding to a batch, sums together copies,
-    with a dictionary word when it is ambiguous.
+    For every example of ``batch``, the extended-vocab indices (``blank``)
+    of its source words that are also in ``tgt_vocab`` and their target
+    indices (``fill``), padded to ``(batch_size, max_words)``; ``valid``
+    is 1. on real entries. Computed once and cached on the batch.
     """
+    key = (id(tgt_vocab), id(src_vocabs))
+    cached = getattr(batch, "_collapse_index", None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
     offset = len(tgt_vocab)
-    for b in range(scores.size(batch_dim)):
-        blank = []
-        fill = []
-        batch_id = batch_offset[b] if batch_offset is not None else b
-        index = batch.indices.data[batch_id]
+    blanks, fills = [], []
+    for index in batch.indices.tolist():
         src_vocab = src_vocabs[index]
+        blank, fill = [], []
         for i in range(1, len(src_vocab)):
             sw = src_vocab.itos[i]
             ti = tgt_vocab.stoi[sw]
             if ti != 0:
                 blank.append(offset + i)
                 fill.append(ti)
-        if blank:
-            blank = torch.Tensor(blank).type_as(batch.indices.data)
-            fill = torch.Tensor(fill).type_as(batch.indices.data)
-            score = scores[:, b] if batch_dim == 1 else scores[b]
-            score.index_add_(1, fill, score.index_select(1, blank))
-            score.index_fill_(1, blank, 1e-10)
+        blanks.append(blank)
+        fills.append(fill)
+    width = max(1, max(len(blank) for blank in blanks))
+    # padding points at column 0 (unk), which fill never targets
+    pad = [[0] * (width - len(blank)) for blank in blanks]
+    device = batch.indices.device
+    index = (
+        torch.tensor([b + p for b, p in zip(blanks, pad)], device=device),
+        torch.tensor([f + p for f, p in zip(fills, pad)], device=device),
+        torch.tensor([[1.] * len(b) + [0.] * len(p)
+                      for b, p in zip(blanks, pad)], device=device))
+    batch._collapse_index = (key, index)
+    return index
+
+
+def collapse_copy_scores(scores, batch, tgt_vocab, src_vocabs,
+                         batch_dim=1, batch_offset=None, shortlist=None):
+    """
+    Given scores from an expanded dictionary
+    corresponeding to a batch, sums together copies,
+    with a dictionary word when it is ambiguous.
+
+    With ``shortlist``, the ``(ids, index)`` pair of a vocabulary
+    shortlist, ``scores`` are over the shortlist followed by the copy
+    vocabulary; every word copied from the source must be in ``ids``.
+    """
+    blank, fill, valid = _collapse_index(batch, tgt_vocab, src_vocabs)
+    if shortlist is not None:
+        ids, index = shortlist
+        fill = index.index_select(0, fill.view(-1)).view_as(fill)
+        blank = torch.where(valid > 0, blank - len(tgt_vocab) + ids.size(0),
+                            blank)
+    if batch_offset is not None:
+        batch_offset = batch_offset.to(blank.device)
+        blank = blank.index_select(0, batch_offset)
+        fill = fill.index_select(0, batch_offset)
+        valid = valid.index_select(0, batch_offset)
+    # shape: (batch, rows, dynamic vocab)
+    score = scores.transpose(0, 1) if batch_dim == 1 else scores
+    shape = (score.size(0), score.size(1), blank.size(1))
+    blank = blank.unsqueeze(1).expand(shape)
+    fill = fill.unsqueeze(1).expand(shape)
+    valid = valid.unsqueeze(1).expand(shape).type_as(score)
+    copied = score.gather(2, blank)
+    score.scatter_add_(2, fill, copied * valid)
+    # padding rewrites column 0 with its own value
+    score.scatter_(2, blank, valid * 1e-10 + (1 - valid) * copied)
     return scores
 
 
@@ -87,12 +131,20 @@ class CopyGenerator(nn.Module):
         self.linear_copy = nn.Linear(input_size, 1)
         self.pad_idx = pad_idx
 
-    def forward(self, hidden, attn, src_map):
+    def forward(self, hidden, attn, src_map, shortlist=None, beam_size=None):
         """
         Compute a distribution over the target dictionary
         extended by the dynamic dictionary implied by copying
         source words.
 
+        With ``shortlist``, the sorted target ids starting with the
+        special tokens, only these words are scored and the output is
+        over the shortlist followed by the copy vocabulary.
+
+        With ``beam_size``, ``src_map`` is shared by the ``beam_size``
+        consecutive rows of ``hidden`` of each batch entry, as in beam
+        search, instead of being repeated for every step.
+
         Args:
            hidden (FloatTensor): hidden outputs ``(batch x tlen, input_size)``
            attn (FloatTensor): attn for each ``(batch x tlen, input_size)``
@@ -100,6 +152,8 @@ class CopyGenerator(nn.Module):
                A sparse indicator matrix mapping each source word to
                its index in the "extended" vocab containing.
                ``(src_len, batch, extra_words)``
+           shortlist (LongTensor): target ids to score, all if ``None``
+           beam_size (int): rows of ``hidden`` per ``src_map`` entry
         """
 
         # CHECKS
@@ -110,7 +164,13 @@ class CopyGenerator(nn.Module):
         aeq(slen, slen_)
 
         # Original probabilities.
-        logits = self.linear(hidden)
+        if shortlist is None:
+            logits = self.linear(hidden)
+        else:
+            # the specials lead the shortlist, pad_idx keeps its column
+            logits = F.linear(hidden,
+                              self.linear.weight.index_select(0, shortlist),
+                              self.linear.bias.index_select(0, shortlist))
         logits[:, self.pad_idx] = -float('inf')
         prob = torch.softmax(logits, 1)
 
@@ -119,10 +179,15 @@ class CopyGenerator(nn.Module):
         # Probability of not copying: p_{word}(w) * (1 - p(z))
         out_prob = torch.mul(prob, 1 - p_copy)
         mul_attn = torch.mul(attn, p_copy)
-        copy_prob = torch.bmm(
-            mul_attn.view(-1, batch, slen).transpose(0, 1),
-            src_map.transpose(0, 1)
-        ).transpose(0, 1)
+        if beam_size is None:
+            copy_prob = torch.bmm(
+                mul_attn.view(-1, batch, slen).transpose(0, 1),
+                src_map.transpose(0, 1)
+            ).transpose(0, 1)
+        else:
+            copy_prob = torch.bmm(
+                mul_attn.view(batch, beam_size, slen),
+                src_map.transpose(0, 1))
         copy_prob = copy_prob.contiguous().view(-1, cvocab)
         return torch.cat([out_prob, copy_prob], 1)
 
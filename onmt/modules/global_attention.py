@@ -94,11 +94,38 @@ class GlobalAttention(nn.Module):
         if coverage:
             self.linear_cover = nn.Linear(1, dim, bias=False)
 
-    def score(self, h_t, h_s):
+    def precompute(self, memory_bank, memory_lengths=None):
+        """
+        The parts of :func:`forward` that only depend on the memory bank,
+        to be computed once for all the decoding steps of a batch.
+
+        Args:
+          memory_bank (FloatTensor): source vectors ``(batch, src_len, dim)``
+          memory_lengths (LongTensor): the source context lengths ``(batch,)``
+
+        Returns:
+          dict[str, Tensor]: the ``forward`` ``cache``, batch first:
+          the ``"pad_mask"`` ``(batch, 1, src_len)`` if lengths are given
+          and for mlp attention, the projected memory bank ``"uh"``
+          ``(batch, 1, src_len, dim)``.
+        """
+        cache = {}
+        if memory_lengths is not None:
+            mask = sequence_mask(memory_lengths, max_len=memory_bank.size(1))
+            cache["pad_mask"] = mask.eq(0).unsqueeze(1)
+        if self.attn_type == "mlp":
+            batch, src_len, dim = memory_bank.size()
+            uh = self.linear_context(memory_bank.contiguous().view(-1, dim))
+            cache["uh"] = uh.view(batch, 1, src_len, dim)
+        return cache
+
+    def score(self, h_t, h_s, uh=None):
         """
         Args:
           h_t (FloatTensor): sequence of queries ``(batch, tgt_len, dim)``
           h_s (FloatTensor): sequence of sources ``(batch, src_len, dim``
+          uh (FloatTensor): ``h_s`` projected by mlp attention, see
+            :func:`precompute`
 
         Returns:
           FloatTensor: raw attention scores (unnormalized) for each src index
@@ -126,8 +153,9 @@ class GlobalAttention(nn.Module):
             wq = wq.view(tgt_batch, tgt_len, 1, dim)
             wq = wq.expand(tgt_batch, tgt_len, src_len, dim)
 
-            uh = self.linear_context(h_s.contiguous().view(-1, dim))
-            uh = uh.view(src_batch, 1, src_len, dim)
+            if uh is None:
+                uh = self.linear_context(h_s.contiguous().view(-1, dim))
+                uh = uh.view(src_batch, 1, src_len, dim)
             uh = uh.expand(src_batch, tgt_len, src_len, dim)
 
             # (batch, t_len, s_len, d)
@@ -135,14 +163,19 @@ class GlobalAttention(nn.Module):
 
             return self.v(wquh.view(-1, dim)).view(tgt_batch, tgt_len, src_len)
 
-    def forward(self, source, memory_bank, memory_lengths=None, coverage=None):
+    def forward(self, source, memory_bank, memory_lengths=None, coverage=None,
+                cache=None):
         """
 
         Args:
-          source (FloatTensor): query vectors ``(batch, tgt_len, dim)``
+          source (FloatTensor): query vectors ``(batch, tgt_len, dim)``,
+            or ``(batch x n, tgt_len, dim)`` to attend ``n`` consecutive
+            queries (e.g. the beams of a sentence) to every memory bank
           memory_bank (FloatTensor): source vectors ``(batch, src_len, dim)``
           memory_lengths (LongTensor): the source context lengths ``(batch,)``
           coverage (FloatTensor): None (not supported yet)
+          cache (dict[str, Tensor]): :func:`precompute` output for
+            ``memory_bank`` and ``memory_lengths``
 
         Returns:
           (FloatTensor, FloatTensor):
@@ -159,6 +192,14 @@ class GlobalAttention(nn.Module):
         else:
             one_step = False
 
+        # shared memory bank, fold the queries of an entry into tgt_len
+        n_shared = source.size(0) // memory_bank.size(0)
+        if n_shared > 1:
+            assert coverage is None, \
+                "Coverage needs one memory bank per query"
+            source = source.contiguous().view(
+                memory_bank.size(0), -1, source.size(-1))
+
         batch, source_l, dim = memory_bank.size()
         batch_, target_l, dim_ = source.size()
         aeq(batch, batch_)
@@ -174,13 +215,20 @@ class GlobalAttention(nn.Module):
             memory_bank += self.linear_cover(cover).view_as(memory_bank)
             memory_bank = torch.tanh(memory_bank)
 
+        if cache is None:
+            cache = {}
+        # coverage changes the memory bank the projection was computed on
+        uh = cache.get("uh") if coverage is None else None
+
         # compute attention scores, as in Luong et al.
-        align = self.score(source, memory_bank)
+        align = self.score(source, memory_bank, uh=uh)
 
         if memory_lengths is not None:
-            mask = sequence_mask(memory_lengths, max_len=align.size(-1))
-            mask = mask.unsqueeze(1)  # Make it broadcastable.
-            align.masked_fill_(1 - mask, -float('inf'))
+            pad_mask = cache.get("pad_mask")
+            if pad_mask is None:
+                mask = sequence_mask(memory_lengths, max_len=align.size(-1))
+                pad_mask = mask.eq(0).unsqueeze(1)  # Make it broadcastable.
+            align.masked_fill_(pad_mask, -float('inf'))
 
         # Softmax or sparsemax to normalize attention weights
         if self.attn_func == "softmax":
@@ -199,6 +247,11 @@ class GlobalAttention(nn.Module):
         if self.attn_type in ["general", "dot"]:
             attn_h = torch.tanh(attn_h)
 
+        if n_shared > 1:
+            batch, target_l = batch * n_shared, target_l // n_shared
+            attn_h = attn_h.view(batch, target_l, dim)
+            align_vectors = align_vectors.view(batch, target_l, source_l)
+
         if one_step:
             attn_h = attn_h.squeeze(1)
             align_vectors = align_vectors.squeeze(1)
@@ -325,6 +325,27 @@ def train_opts(parser):
     group.add('--drqa_param_path', '-drqa_model_path',
               default=os.path.join("drqa_param", "params/000000010.params"),
               help=".")
+    group.add('--drqa_cache_size', '-drqa_cache_size', type=int, default=0,
+              help="Number of tokenized passages kept in an LRU cache "
+                   "for DrQA reward queries (0 disables the cache).")
+    group.add('--drqa_cache_encodings', '-drqa_cache_encodings',
+              action="store_true",
+              help="Also cache the question-independent passage "
+                   "encodings of DrQA (kept on the DrQA device).")
+    group.add('--drqa_doc_store', '-drqa_doc_store', default=None,
+              help="Directory of precomputed DrQA passage encodings "
+                   "(see tools/precompute_drqa_docs.py); looked up by "
+                   "training example index before the passage cache.")
+    group.add('--rl_reward_workers', '-rl_reward_workers', type=int,
+              default=0,
+              help="Number of CPU processes scoring the RL rewards with "
+                   "their own DrQA copy, overlapped with the MLE updates "
+                   "(0 scores them inline).")
+    group.add('--rl_reward_staleness', '-rl_reward_staleness', type=int,
+              default=1,
+              help="With -rl_reward_workers, maximum number of steps a "
+                   "policy-gradient update may lag behind the batch it "
+                   "was decoded from.")
 
     group.add('--data_type', '-data_type', default="text",
               help="Type of the source input. Options: [text|img].")
@@ -709,6 +730,11 @@ def translate_opts(parser):
                    "(higher = longer generation)")
     group.add('--beta', '-beta', type=float, default=-0.,
               help="Coverage penalty parameter")
+    group.add('--beam_bound_stopping', '-beam_bound_stopping',
+              action='store_true',
+              help="Stop decoding a sentence as soon as none of its alive "
+                   "beams can outscore its n_best finished hypotheses. "
+                   "Ignored with -stepwise_penalty or a negative -beta.")
     group.add('--block_ngram_repeat', '-block_ngram_repeat',
               type=int, default=0,
               help='Block repetition of ngrams during decoding.')
@@ -745,8 +771,34 @@ def translate_opts(parser):
     group = parser.add_argument_group('Efficiency')
     group.add('--batch_size', '-batch_size', type=int, default=32,
               help='Batch size')
+    group.add('--batch_type', '-batch_type', default='sents',
+              choices=["sents", "tokens"],
+              help="Batch grouping for batch_size. With tokens, examples "
+                   "are bucketed by length and batch_size bounds the "
+                   "passage and history tokens of a batch, padding "
+                   "included. Outputs keep the input order.")
     group.add('--gpu', '-gpu', type=int, default=-1,
               help="Device to run on")
+    group.add('--workers', '-workers', type=int, default=1,
+              help="Translate on CPU with this many forked processes "
+                   "sharing the loaded model, each using an equal share "
+                   "of the intra-op threads. Shards (or length buckets "
+                   "with -batch_type tokens) are spread over them and "
+                   "the output keeps the input order.")
+    group.add('--encoder_branch_threads', '-encoder_branch_threads',
+              type=int, default=0,
+              help="Encode the conversation history in a separate thread "
+                   "with this many intra-op threads, concurrently with the "
+                   "passage. 0 encodes them one after the other.")
+    group.add('--quantize', '-quantize', default=None, choices=['int8'],
+              help="Dynamically quantize the recurrent and linear layers "
+                   "of the model for CPU inference. Checkpoints written "
+                   "by tools/quantize_model.py are quantized when loaded.")
+    group.add('--vocab_shortlist', '-vocab_shortlist', type=int, default=0,
+              help="Compute the generator softmax only over a per-batch "
+                   "shortlist: the passage and history words, the K most "
+                   "frequent target words and the special tokens. "
+                   "0 uses the whole target vocabulary.")
 
     # Options most relevant to speech.
     group = parser.add_argument_group('Speech')
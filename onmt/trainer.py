@@ -9,11 +9,13 @@
           users of this library) for the strategy things we do.
 """
 
-from copy import deepcopy
+from collections import deque
+from copy import copy, deepcopy
 import itertools
 import torch
 from tqdm import tqdm
 import onmt.utils
+from onmt.utils.misc import tile
 from onmt.utils.logging import logger
 from random import random
 
@@ -53,6 +55,15 @@ def build_trainer(opt, device_id, model, fields, optim, model_saver=None):
     gpu_verbose_level = opt.gpu_verbose_level
 
     report_manager = onmt.utils.build_report_manager(opt)
+    reward_pool = None
+    if opt.enable_rl_after >= 0 and opt.rl_reward_workers > 0:
+        from clta.reward_pool import RewardWorkerPool
+        reward_pool = RewardWorkerPool(
+            opt.rl_reward_workers, opt.drqa_vocab_path,
+            opt.drqa_config_path, opt.drqa_param_path,
+            cache_size=opt.drqa_cache_size,
+            cache_encodings=opt.drqa_cache_encodings,
+            doc_store=opt.drqa_doc_store)
     trainer = onmt.Trainer(model, train_loss, valid_loss, optim, trunc_size,
                            shard_size, norm_method,
                            grad_accum_count, n_gpu, gpu_rank,
@@ -63,7 +74,9 @@ def build_trainer(opt, device_id, model, fields, optim, model_saver=None):
                            average_every=average_every,
                            model_dtype=opt.model_dtype,
                            enable_rl_after=opt.enable_rl_after,
-                           rl_save_step=opt.rl_save_step)
+                           rl_save_step=opt.rl_save_step,
+                           reward_pool=reward_pool,
+                           rl_reward_staleness=opt.rl_reward_staleness)
     return trainer
 
 
@@ -90,13 +103,18 @@ class Trainer(object):
             model_saver(:obj:`onmt.models.ModelSaverBase`): the saver is
                 used to save a checkpoint.
                 Thus nothing will be saved if this parameter is None
+            reward_pool(:obj:`clta.reward_pool.RewardWorkerPool`): scores
+                the RL rewards asynchronously, or None to score them inline
+            rl_reward_staleness(int): maximum number of steps a
+                policy-gradient update may lag behind its batch
     """
 
     def __init__(self, model, train_loss, valid_loss, optim,
                  trunc_size=0, shard_size=32,
                  norm_method="sents", grad_accum_count=1, n_gpu=1, gpu_rank=1,
                  gpu_verbose_level=0, report_manager=None, model_saver=None,
-                 average_decay=0, average_every=1, model_dtype='fp32', enable_rl_after=-1, rl_save_step=1000, tgt_field=None):
+                 average_decay=0, average_every=1, model_dtype='fp32', enable_rl_after=-1, rl_save_step=1000, tgt_field=None,
+                 reward_pool=None, rl_reward_staleness=1):
         # Basic attributes.
         self.model = model
         self.train_loss = train_loss
@@ -119,6 +137,9 @@ class Trainer(object):
         self.rl_save_step = rl_save_step
         self.tgt_field = tgt_field
         self.trigger = random()
+        self.reward_pool = reward_pool
+        self.rl_reward_staleness = rl_reward_staleness
+        self._pending_rewards = deque()
 
         assert grad_accum_count > 0
         if grad_accum_count > 1:
@@ -254,6 +275,9 @@ class Trainer(object):
             if train_steps > 0 and local_step >= train_steps:
                 break
 
+        if self.reward_pool is not None:
+            self._apply_pending_rewards(local_step, flush=True)
+            self.reward_pool.close()
 
         if self.model_saver is not None:
             self.model_saver.save(local_step, moving_average=self.moving_average)
@@ -283,11 +307,12 @@ class Trainer(object):
             for batch in valid_iter:
                 src, src_lengths = batch.src if isinstance(batch.src, tuple) \
                                    else (batch.src, None)
-                history, history_lengths = batch.history if isinstance(batch.history, tuple) else (batch.src, None)
+                history, history_lengths = batch.history if isinstance(batch.history, tuple) else (batch.history, None)
                 tgt = batch.tgt
 
                 # F-prop through the model.
-                outputs, attns, _ = valid_model(src, history, tgt, src_lengths, history_lengths)
+                outputs, attns, _ = valid_model(batch, src, history, tgt, src_lengths, history_lengths,
+                                                translate=False)
 
                 # Compute loss.
                 _, batch_stats = self.valid_loss(batch, outputs, attns)
@@ -318,6 +343,149 @@ class Trainer(object):
         return tokens
 
 
+    def _sampled_targets(self, batch, preds_n, beam_size):
+        """Turn the decoded questions into one ``tgt`` tensor per beam.
+
+        ``preds_n`` follow the ``batch.indices`` order of
+        ``Translator.reverse``; the returned ``(tgt_len, batch, 1)`` tensors
+        follow the columns of ``batch.tgt``.
+        """
+        vocab = self.tgt_field.vocab
+        old_tgt = batch.tgt
+        max_len_tgt = old_tgt.size(0)
+        _, perm = torch.sort(batch.indices)
+        new_tgts = []
+        for b in range(beam_size):
+            new_tgt = torch.full_like(old_tgt, vocab.stoi[self.tgt_field.pad_token])
+            new_tgt[0].fill_(vocab.stoi[self.tgt_field.init_token])
+            for batch_id, column in enumerate(perm.tolist()):
+                if len(preds_n[batch_id]) == 0:
+                    continue
+                pred_n = preds_n[batch_id][b]
+                assert len(pred_n) < max_len_tgt
+                new_tgt[1:1 + len(pred_n), column, 0] = pred_n
+            new_tgts.append(new_tgt)
+        return new_tgts
+
+    def _reward_queries(self, batch, preds, src_raws, target_ans, beam_size):
+        """Collect the DrQA queries for the questions of every beam.
+
+        Returns the ``(beam, column)`` of every query followed by the
+        passage keys, passages, questions and answers to score. Empty
+        questions are not scored.
+        """
+        example_ids, perm = torch.sort(batch.indices)
+        example_ids, perm = example_ids.tolist(), perm.tolist()
+        keys, doc_keys, docs, ques, targets = [], [], [], [], []
+        for b in range(beam_size):
+            for batch_id in range(len(preds)):
+                pred = preds[batch_id][b]
+                if len(pred) == 0:
+                    continue
+                keys.append((b, perm[batch_id]))
+                doc_keys.append(example_ids[batch_id])
+                docs.append(' '.join(src_raws[batch_id]))
+                ques.append(' '.join(pred))
+                targets.append(' '.join(target_ans[batch_id]))
+        return keys, doc_keys, docs, ques, targets
+
+    @staticmethod
+    def _reward_scales(keys, f1_scores, beam_size, batch_size, device):
+        """``beam_size x batch`` loss scales ``1 - F1`` (1.0 if unscored)."""
+        scales = torch.ones(beam_size, batch_size, device=device)
+        for (b, column), f1_score in zip(keys, f1_scores):
+            scales[b, column] = 1.0 - f1_score
+        return scales
+
+    @staticmethod
+    def _tile_batch(batch, count):
+        """Shallow copy of ``batch`` with every example repeated ``count``
+        times in a row, which keeps the columns sorted by src length.
+        """
+        tiled = copy(batch)
+        for name in batch.fields:
+            value = getattr(batch, name, None)
+            if value is None:
+                continue
+            if isinstance(value, tuple):
+                value = (tile(value[0], count, dim=1),
+                         tile(value[1], count))
+            else:
+                value = tile(value, count, dim=0 if name == "indices" else 1)
+            setattr(tiled, name, value)
+        tiled.batch_size = batch.batch_size * count
+        # cached for the untiled columns
+        tiled.__dict__.pop("_collapse_index", None)
+        return tiled
+
+    def _replay_policy_gradient(self, batch, new_tgts, rewards,
+                                normalization):
+        """Policy-gradient update for questions decoded from ``batch``.
+
+        The model has changed since the questions were decoded, so instead
+        of the beam search graph the decoder is teacher-forced on them, the
+        questions of all the beams in one forward pass over ``batch``
+        tiled ``beam_size`` times.
+        """
+        beam_size = len(new_tgts)
+        tiled = self._tile_batch(batch, beam_size)
+        src, src_lengths = tiled.src if isinstance(tiled.src, tuple) \
+            else (tiled.src, None)
+        history, history_lengths = tiled.history if isinstance(tiled.history, tuple) \
+            else (tiled.history, None)
+        vocab = self.tgt_field.vocab
+        unk = vocab.stoi[self.tgt_field.unk_token]
+        # column i * beam_size + b holds beam b of example i
+        tiled.tgt = torch.stack(new_tgts, 2).view(
+            new_tgts[0].size(0), -1, new_tgts[0].size(2))
+        scales = rewards.t().contiguous().view(-1)
+        if self.grad_accum_count == 1:
+            self.optim.zero_grad()
+        # copied words are fed back as unk, as in the translator
+        dec_in = tiled.tgt.masked_fill(tiled.tgt.ge(len(vocab)), unk)
+        outputs, attns, _ = self.model(
+            tiled, src, history, dec_in, src_lengths, history_lengths,
+            translate=False)
+        loss, _ = self.train_loss(
+            tiled,
+            outputs,
+            attns,
+            normalization=normalization,
+            shard_size=self.shard_size,
+            trunc_start=0,
+            trunc_size=tiled.tgt.size(0),
+            scales=scales)
+        if loss is not None:
+            self.optim.backward(loss)
+        if self.grad_accum_count == 1:
+            if self.n_gpu > 1:
+                grads = [p.grad.data for p in self.model.parameters()
+                         if p.requires_grad
+                         and p.grad is not None]
+                onmt.utils.distributed.all_reduce_and_rescale_tensors(
+                    grads, float(1))
+            self.optim.step(rl=True)
+
+    def _apply_pending_rewards(self, local_step, flush=False):
+        """Apply the policy-gradient updates whose rewards are available.
+
+        Updates are applied in submission order as soon as their rewards
+        arrive, and at the latest ``rl_reward_staleness`` steps after their
+        batch. Multi-GPU training always waits for the latter so that all
+        ranks step together.
+        """
+        while self._pending_rewards:
+            step, batch, new_tgts, keys, rewards, normalization = \
+                self._pending_rewards[0]
+            stale = local_step - step >= self.rl_reward_staleness
+            if not (flush or stale or (self.n_gpu <= 1 and rewards.ready())):
+                break
+            self._pending_rewards.popleft()
+            scales = self._reward_scales(keys, rewards.get(), len(new_tgts),
+                                         batch.batch_size, batch.tgt.device)
+            self._replay_policy_gradient(batch, new_tgts, scales,
+                                         normalization)
+
     def _gradient_accumulation(self, true_batches, normalization, total_stats,
                                report_stats, local_step):
 
@@ -345,86 +513,71 @@ class Trainer(object):
             if self.grad_accum_count == 1:
                 self.optim.zero_grad()
             # outputs: seq, batch_size, linear_hidden
-            outputs, attns, results = self.model(batch, src, history, tgt, src_lengths, history_lengths, bptt=bptt)
-            preds_n, preds, src_raws, target_ans = self.model.reverse(results)
-            scores = results['scores']
-            if self.enable_rl_after >= 0 and local_step > self.enable_rl_after and self.trigger < 0.2:
+            # the search only runs when its questions are rewarded
+            need_rl = self.enable_rl_after >= 0 and local_step > self.enable_rl_after and self.trigger < 0.2
+            # delayed updates replay the questions, so their search
+            # keeps no graph
+            outputs, attns, results = self.model(batch, src, history, tgt, src_lengths, history_lengths, bptt=bptt,
+                                                 translate=need_rl,
+                                                 keep_dec_outputs=self.reward_pool is None)
+            if need_rl:
+                preds_n, preds, src_raws, target_ans = self.model.reverse(results)
                 torch.autograd.set_detect_anomaly(True)
-                beam_size = results['dec_outputs'].size(2)
-                for b in range(beam_size):
-                    this_outputs = results['dec_outputs'][:, :, b, :]
-                    best_value, best_index = this_outputs.max(-1)
-                    this_attns = {}
-                    for key in results['dec_attns'].keys():
-                        this_attns[key] = results['dec_attns'][key][:, :, b, :]
-                    assert batch.tgt.size(0) - 1 == this_outputs.size(0), " {} {}".format(batch.tgt.size(), this_outputs.size())
-                    scales = []
+                beam_size = self.model.translator.beam_size
+                new_tgts = self._sampled_targets(batch, preds_n, beam_size)
+                keys, doc_keys, docs, ques, targets = self._reward_queries(
+                    batch, preds, src_raws, target_ans, beam_size)
+                if self.reward_pool is not None:
+                    # scored in the background, applied by
+                    # _apply_pending_rewards after the MLE update
+                    rewards = self.reward_pool.submit(
+                        docs, ques, targets, doc_keys=doc_keys)
+                    self._pending_rewards.append(
+                        (local_step, batch, new_tgts, keys, rewards,
+                         normalization))
+                else:
+                    f1_scores = self.model.drqa_predict_batch(
+                        docs, ques, targets, doc_keys=doc_keys)['f1'] if keys else []
+                    rewards = self._reward_scales(
+                        keys, f1_scores, beam_size, batch.batch_size,
+                        results['dec_outputs'].device)
                     old_tgt = batch.tgt
-                    max_len_tgt = old_tgt.size(0)
-                    new_tgt = None
-                    for batch_id in range(len(preds)):
-                        pred = preds[batch_id][b]
-                        if len(preds_n[batch_id]) == 0:
-                            pred_n = torch.tensor([], dtype=old_tgt.dtype)
-                        else:
-                            pred_n = preds_n[batch_id][b]
-                        assert len(pred_n) < max_len_tgt
-                        padding_num = max_len_tgt - 1 - len(pred_n)
-                        padding_vec = torch.ones(padding_num, dtype=old_tgt.dtype)
-                        if self.n_gpu >= 1:
-                            padding_vec = padding_vec.cuda()
-                            pred_n = pred_n.cuda()
-                        pred_tgt = torch.cat((pred_n, padding_vec), 0).unsqueeze(0) # 1 * (max_len - 1)
-                        if new_tgt is not None:
-                            new_tgt = torch.cat((new_tgt, pred_tgt), 0)
-                        else:
-                            new_tgt = pred_tgt
-                        src_raw = src_raws[batch_id]
-                        ans = target_ans[batch_id]
-                        if len(pred) == 0:
-                            scales.append(1.0)
-                            continue
-                        drqa_results = self.model.drqa_predict(
-                            doc=' '.join(src_raw), que=' '.join(pred), target=' '.join(ans))
-                        f1_score = drqa_results['f1']
-                        scales.append(1.0 - f1_score)
-                    scales = torch.tensor(scales, device=this_outputs.device)
-                    new_tgt = new_tgt.permute(1, 0)
-                    # # init token id
-                    new_tgt_bos = torch.ones(size=(1, old_tgt.size(1)), dtype=old_tgt.dtype) * 2
-                    if self.n_gpu >= 1:
-                        new_tgt_bos = new_tgt_bos.cuda()
-                    new_tgt = torch.cat([new_tgt_bos, new_tgt], dim=0).unsqueeze(-1)
-                    batch.tgt = new_tgt
-                    loss, batch_stats = self.train_loss(
-                         batch,
-                         this_outputs,
-                         this_attns,
-                         normalization=normalization,
-                         shard_size=self.shard_size,
-                         trunc_start=0,
-                         trunc_size=trunc_size,
-                         retain_graph=True,
-                         scales=scales)
-                    batch.tgt = old_tgt
-                    # If truncated, don't backprop fully.
-                    # TO CHECK
-                    # if dec_state is not None:
-                    #    dec_state.detach()
-                    if self.model.decoder.state is not None:
-                        self.model.decoder.detach_state()
-                    if loss is not None:
-                        self.optim.backward(loss)
-                # --------------------------------
-                # update only after all beam have done
-                if self.grad_accum_count == 1:
-                    if self.n_gpu > 1:
-                        grads = [p.grad.data for p in self.model.parameters()
-                                 if p.requires_grad
-                                 and p.grad is not None]
-                        onmt.utils.distributed.all_reduce_and_rescale_tensors(
-                            grads, float(1))
-                    self.optim.step(rl=True)
+                    for b in range(beam_size):
+                        this_outputs = results['dec_outputs'][:, :, b, :]
+                        this_attns = {}
+                        for key in results['dec_attns'].keys():
+                            this_attns[key] = results['dec_attns'][key][:, :, b, :]
+                        assert batch.tgt.size(0) - 1 == this_outputs.size(0), " {} {}".format(batch.tgt.size(), this_outputs.size())
+                        batch.tgt = new_tgts[b]
+                        loss, batch_stats = self.train_loss(
+                             batch,
+                             this_outputs,
+                             this_attns,
+                             normalization=normalization,
+                             shard_size=self.shard_size,
+                             trunc_start=0,
+                             trunc_size=trunc_size,
+                             retain_graph=True,
+                             scales=rewards[b])
+                        batch.tgt = old_tgt
+                        # If truncated, don't backprop fully.
+                        # TO CHECK
+                        # if dec_state is not None:
+                        #    dec_state.detach()
+                        if self.model.decoder.state is not None:
+                            self.model.decoder.detach_state()
+                        if loss is not None:
+                            self.optim.backward(loss)
+                    # --------------------------------
+                    # update only after all beam have done
+                    if self.grad_accum_count == 1:
+                        if self.n_gpu > 1:
+                            grads = [p.grad.data for p in self.model.parameters()
+                                     if p.requires_grad
+                                     and p.grad is not None]
+                            onmt.utils.distributed.all_reduce_and_rescale_tensors(
+                                grads, float(1))
+                        self.optim.step(rl=True)
 
             if self.grad_accum_count == 1:
                 self.optim.zero_grad()
@@ -457,6 +610,9 @@ class Trainer(object):
             total_stats.update(batch_stats)
             report_stats.update(batch_stats)
 
+            if self._pending_rewards:
+                self._apply_pending_rewards(local_step)
+
         # in case of multi step gradient accumulation,
         # update only after accum batches
         if self.grad_accum_count > 1:
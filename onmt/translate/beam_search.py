@@ -26,8 +26,13 @@ class BeamSearch(DecodeStrategy):
         return_attention (bool): See base.
         block_ngram_repeat (int): See base.
         exclusion_tokens (set[int]): See base.
-        memory_lengths (LongTensor): Lengths of encodings. Used for
-            masking attentions.
+        memory_lengths (LongTensor): Lengths of encodings, shaped
+            ``(batch_size,)``. Used for masking attentions.
+        keep_dec_outputs (bool): See base.
+        bound_stopping (bool): Also retire a batch as soon as the score of
+            its ``n_best``-th finished hypothesis is at least the best
+            score any alive beam can still reach. Ignored when scores are
+            not bounded that way (stepwise or negative coverage penalty).
 
     Attributes:
         top_beam_finished (ByteTensor): Shape ``(B,)``.
@@ -49,29 +54,49 @@ class BeamSearch(DecodeStrategy):
             ``(B, beam_size)``. Initialized to ``None``.
         _coverage (FloatTensor or NoneType): Shape
             ``(1, B x beam_size, inp_seq_len)``.
-        hypotheses (list[list[Tuple[Tensor]]]): Contains a tuple
-            of score (float), sequence (long), and attention (float or None).
+        _best_scores (FloatTensor): Shape ``(batch_size, n_best)``. Scores
+            of the best finished hypotheses, ``-inf`` while missing.
+        _best_seqs (LongTensor): Shape
+            ``(batch_size, n_best, max_length)``, their padded predictions.
+        _best_lengths (LongTensor): Shape ``(batch_size, n_best)``.
+        _best_attn (FloatTensor or NoneType): Shape
+            ``(batch_size, n_best, max_length, inp_seq_len)`` if attention
+            is returned.
+        _n_finished (LongTensor): Shape ``(batch_size,)``. Number of
+            finished hypotheses.
     """
 
     def __init__(self, beam_size, batch_size, pad, bos, eos, n_best, mb_device,
                  global_scorer, min_length, max_length, return_attention,
                  block_ngram_repeat, exclusion_tokens, memory_lengths,
-                 stepwise_penalty):
+                 stepwise_penalty, keep_dec_outputs=False,
+                 bound_stopping=False):
         super(BeamSearch, self).__init__(
             pad, bos, eos, batch_size, mb_device, beam_size, min_length,
             block_ngram_repeat, exclusion_tokens, return_attention,
-            max_length)
+            max_length, keep_dec_outputs)
         # beam parameters
         self.global_scorer = global_scorer
         self.beam_size = beam_size
         self.n_best = n_best
         self.batch_size = batch_size
 
-        # result caching
-        self.hypotheses = [[] for _ in range(batch_size)]
+        # best finished hypotheses
+        self._best_scores = torch.full(
+            [batch_size, n_best], float("-inf"), device=mb_device)
+        self._best_seqs = torch.full(
+            [batch_size, n_best, max_length], pad, dtype=torch.long,
+            device=mb_device)
+        self._best_lengths = torch.zeros(
+            [batch_size, n_best], dtype=torch.long, device=mb_device)
+        self._best_attn = None
+        self._n_finished = torch.zeros(
+            [batch_size], dtype=torch.long, device=mb_device)
+        self._reported = [False] * batch_size
 
         # beam state
-        self.top_beam_finished = torch.zeros([batch_size], dtype=torch.uint8)
+        self.top_beam_finished = torch.zeros(
+            [batch_size], dtype=torch.uint8, device=mb_device)
         self._batch_offset = torch.arange(batch_size, dtype=torch.long)
         self._beam_offset = torch.arange(
             0, batch_size * beam_size, step=beam_size, dtype=torch.long,
@@ -81,6 +106,10 @@ class BeamSearch(DecodeStrategy):
         ).repeat(batch_size)
         self.select_indices = None
         self._memory_lengths = memory_lengths
+        # attention of each batch is trimmed to its source length
+        self._src_lengths = (
+            memory_lengths.tolist() if memory_lengths is not None
+            else [None] * batch_size)
 
         # buffers for the topk scores and 'backpointer'
         self.topk_scores = torch.empty((batch_size, beam_size),
@@ -99,6 +128,12 @@ class BeamSearch(DecodeStrategy):
         self._vanilla_cov_pen = (
             not stepwise_penalty and self.global_scorer.has_cov_pen)
         self._cov_pen = self.global_scorer.has_cov_pen
+        # log probs only decrease and a finished hypothesis is at most
+        # its log prob over the length penalty, unless the coverage
+        # penalty changes the beam scores or can be a bonus
+        self.bound_stopping = bound_stopping and not (
+            self._stepwise_cov_pen
+            or (self._cov_pen and self.global_scorer.beta < 0))
 
     @property
     def current_predictions(self):
@@ -108,6 +143,11 @@ class BeamSearch(DecodeStrategy):
     def current_origin(self):
         return self.select_indices
 
+    @property
+    def current_batch_origin(self):
+        """Batch row of the previous step every batch row comes from."""
+        return self._batch_index[:, 0].div(self.beam_size)
+
     @property
     def current_backptr(self):
         # for testing
@@ -116,7 +156,6 @@ class BeamSearch(DecodeStrategy):
 
     def advance(self, log_probs, attn, dec_out_attn):
         vocab_size = log_probs.size(-1)
-        dec_out, dec_attn = dec_out_attn
 
         # using integer division to get an integer _B without casting
         _B = log_probs.shape[0] // self.beam_size
@@ -162,22 +201,11 @@ class BeamSearch(DecodeStrategy):
         self.select_indices = self._batch_index.view(_B * self.beam_size)
 
         self.topk_ids.fmod_(vocab_size)  # resolve true word ids
-        if self.dec_outputs is None:
-            self.dec_outputs = dec_out
-        else:
-            self.dec_outputs = torch.cat(
-                    [self.dec_outputs.index_select(1, self.select_indices),
-                     dec_out], 0)
-            # self.dec_outputs = torch.cat((self.dec_outputs, dec_out), 0)
-        for key in dec_attn.keys():
-            if key not in self.dec_attns:
-                self.dec_attns[key] = dec_attn[key]
-            else:
-                self.dec_attns[key] = torch.cat(
-                        [self.dec_attns[key].index_select(1, self.select_indices), dec_attn[key]])
+        self.record_dec_out(dec_out_attn, self.select_indices)
 
         # Append last prediction.
         # resort
+        self.reorder_ngram_state(self.select_indices)
         self.alive_seq = torch.cat(
             [self.alive_seq.index_select(0, self.select_indices),
              self.topk_ids.view(_B * self.beam_size, 1)], -1)
@@ -213,14 +241,78 @@ class BeamSearch(DecodeStrategy):
         self.ensure_max_length()
         # alive_seq: batch_size * beam_size, max_len
 
+    def _merge_finished(self, predictions, attention):
+        """Merge the beams that just finished into the best hypotheses.
+
+        The ``n_best`` best hypotheses of every batch are kept in
+        preallocated buffers, indexed by the original batch index, and
+        updated with one top-k over the previous best and the finished
+        beams.
+        """
+        _B, width = predictions.size(0), predictions.size(-1) - 1
+        rows = self._batch_offset.to(self.topk_scores.device)
+        cand_scores = self.topk_scores.masked_fill(
+            self.is_finished.eq(0), float("-inf"))
+        scores = torch.cat(
+            [self._best_scores.index_select(0, rows), cand_scores], 1)
+        scores, index = scores.topk(self.n_best, dim=1)
+        self._best_scores[rows] = scores
+
+        # every earlier hypothesis is shorter than the finished beams
+        seqs = torch.cat([self._best_seqs.index_select(0, rows)[:, :, :width],
+                          predictions[:, :, 1:]], 1)  # Ignore start_token.
+        self._best_seqs[rows, :, :width] = seqs.gather(
+            1, index.unsqueeze(2).expand(_B, self.n_best, width))
+        lengths = torch.cat(
+            [self._best_lengths.index_select(0, rows),
+             self._best_lengths.new_full((_B, self.beam_size), width)], 1)
+        self._best_lengths[rows] = lengths.gather(1, index)
+        self._n_finished.index_add_(0, rows, self.is_finished.sum(1).long())
+
+        if attention is not None:
+            inp_seq_len = attention.size(-1)
+            if self._best_attn is None:
+                self._best_attn = attention.new_zeros(
+                    [self.batch_size, self.n_best, self.max_length,
+                     inp_seq_len])
+            # shape: (B, n_best + beam_size, width, inp_seq_len)
+            attn = torch.cat([self._best_attn[rows, :, :width],
+                              attention.permute(1, 2, 0, 3)], 1)
+            self._best_attn[rows, :, :width] = attn.gather(
+                1, index.view(_B, self.n_best, 1, 1).expand(
+                    _B, self.n_best, width, inp_seq_len))
+
+    def _report(self, batch_ids):
+        """Materialize the best hypotheses of the done ``batch_ids``."""
+        lengths = self._best_lengths[batch_ids].tolist()
+        for b, b_lengths in zip(batch_ids, lengths):
+            for n, length in enumerate(b_lengths):
+                self.scores[b].append(self._best_scores[b, n].clone())
+                self.predictions[b].append(
+                    self._best_seqs[b, n, :length].clone())
+                self.attention[b].append(
+                    self._best_attn[b, n, :length, :self._src_lengths[b]]
+                    .clone() if self._best_attn is not None else [])
+            self._reported[b] = True
+
+    def _bound_reached(self, rows, step):
+        """Batches whose alive beams cannot enter their n_best anymore."""
+        # the length penalty is monotonic, the next hypotheses finish
+        # with length step + 1 at the earliest
+        alpha = self.global_scorer.alpha
+        max_penalty = max(
+            self.global_scorer.length_penalty(step + 1, alpha=alpha),
+            self.global_scorer.length_penalty(self.max_length + 1,
+                                              alpha=alpha))
+        bound = self.topk_log_probs.max(1)[0] / max_penalty
+        return self._n_finished.index_select(0, rows).ge(self.n_best) & \
+            self._best_scores.index_select(0, rows)[:, -1].ge(bound)
+
     def update_finished(self, training):
         # Penalize beams that finished.
         _B_old = self.topk_log_probs.shape[0]
         step = self.alive_seq.shape[-1]  # 1 greater than the step in advance
         self.topk_log_probs.masked_fill_(self.is_finished, -1e10)
-        # on real data (newstest2017) with the pretrained transformer,
-        # it's faster to not move this back to the original device
-        self.is_finished = self.is_finished.to('cpu')
         self.top_beam_finished |= self.is_finished[:, 0].eq(1)
         # predictions: batch_size, beam_size, max_step + 1
         predictions = self.alive_seq.view(_B_old, self.beam_size, step)
@@ -229,34 +321,26 @@ class BeamSearch(DecodeStrategy):
             self.alive_attn.view(
                 step - 1, _B_old, self.beam_size, self.alive_attn.size(-1))
             if self.alive_attn is not None else None)
-        non_finished_batch = []
-        # batch
-        for i in range(self.is_finished.size(0)):
-            b = self._batch_offset[i]
-            finished_hyp = self.is_finished[i].nonzero().view(-1)
-            # Store finished hypotheses for this batch.
-            for j in finished_hyp:
-                self.hypotheses[b].append((
-                    self.topk_scores[i, j],
-                    predictions[i, j, 1:],  # Ignore start_token.
-                    attention[:, i, j, :self._memory_lengths[i]]
-                    if attention is not None else None))
-            # End condition is the top beam finished and we can return
-            # n_best hypotheses.
-            if self.top_beam_finished[i] and len(
-                    self.hypotheses[b]) >= self.n_best:
-                best_hyp = sorted(
-                    self.hypotheses[b], key=lambda x: x[0], reverse=True)
-                for n, (score, pred, attn) in enumerate(best_hyp):
-                    if n >= self.n_best:
-                        break
-                    self.scores[b].append(score)
-                    self.predictions[b].append(pred)
-                    self.attention[b].append(
-                        attn if attn is not None else [])
-            else:
+        self._merge_finished(predictions, attention)
+
+        # End condition is the top beam finished and we can return
+        # n_best hypotheses.
+        rows = self._batch_offset.to(self.topk_scores.device)
+        batch_done = self.top_beam_finished.eq(1) & \
+            self._n_finished.index_select(0, rows).ge(self.n_best)
+        if self.bound_stopping and not training:
+            batch_done |= self._bound_reached(rows, step)
+        non_finished_batch, done_batch = [], []
+        for i, (b, done) in enumerate(zip(self._batch_offset.tolist(),
+                                          batch_done.tolist())):
+            if not done:
                 non_finished_batch.append(i)
-        non_finished = torch.tensor(non_finished_batch)
+            elif not self._reported[b]:
+                # while training, done batches stay until the end
+                done_batch.append(b)
+        if done_batch:
+            self._report(done_batch)
+        non_finished = torch.tensor(non_finished_batch, dtype=torch.long)
         # If all sentences are translated, no need to go further.
         if len(non_finished) == 0:
             self.done = True
@@ -264,16 +348,20 @@ class BeamSearch(DecodeStrategy):
         if not training:
             # Remove finished batches for the next step.
             _B_new = non_finished.shape[0]
-            self.top_beam_finished = self.top_beam_finished.index_select(
-                0, non_finished)
             self._batch_offset = self._batch_offset.index_select(0, non_finished)
             non_finished = non_finished.to(self.topk_ids.device)
+            self.top_beam_finished = self.top_beam_finished.index_select(
+                0, non_finished)
             self.topk_log_probs = self.topk_log_probs.index_select(0,
                                                                    non_finished)
             self._batch_index = self._batch_index.index_select(0, non_finished)
             self.select_indices = self._batch_index.view(_B_new * self.beam_size)
             self.alive_seq = predictions.index_select(0, non_finished) \
                 .view(-1, self.alive_seq.size(-1))
+            self.reorder_ngram_state(
+                self._beam_offset.index_select(0, non_finished).view(-1, 1)
+                .add(torch.arange(self.beam_size, device=non_finished.device))
+                .view(-1))
             self.topk_scores = self.topk_scores.index_select(0, non_finished)
             self.topk_ids = self.topk_ids.index_select(0, non_finished)
             if self.alive_attn is not None:
@@ -24,6 +24,8 @@ class DecodeStrategy(object):
             tokens, it may repeat.
         return_attention (bool): Whether to work with attention too. If this
             is true, it is assumed that the decoder is attentional.
+        keep_dec_outputs (bool): Keep the decoder output of every step,
+            see :func:`gather_dec_outputs()`.
 
     Attributes:
         pad (int): See above.
@@ -52,11 +54,12 @@ class DecodeStrategy(object):
         exclusion_tokens (set[int]): See above.
         return_attention (bool): See above.
         done (bool): See above.
+        keep_dec_outputs (bool): See above.
     """
 
     def __init__(self, pad, bos, eos, batch_size, device, parallel_paths,
                  min_length, block_ngram_repeat, exclusion_tokens,
-                 return_attention, max_length):
+                 return_attention, max_length, keep_dec_outputs=False):
 
         # magic indices
         self.pad = pad
@@ -75,14 +78,20 @@ class DecodeStrategy(object):
             [batch_size, parallel_paths],
             dtype=torch.uint8, device=device)
         self.alive_attn = None
-        self.dec_outputs = None
-        self.dec_attns = {}
+
+        # decoder outputs of every step and the path 'backpointers'
+        self.keep_dec_outputs = keep_dec_outputs
+        self._dec_out_steps = []
+        self._dec_attn_steps = {}
+        self._backptrs = None
 
         self.min_length = min_length
         self.max_length = max_length
         self.block_ngram_repeat = block_ngram_repeat
         self.exclusion_tokens = exclusion_tokens
         self.return_attention = return_attention
+        self._exclusion_idxs = None
+        self._repeated_ngram = None
 
         self.done = False
 
@@ -101,25 +110,103 @@ class DecodeStrategy(object):
             self.is_finished.fill_(1)
 
     def block_ngram_repeats(self, log_probs):
-        cur_len = len(self)
-        if self.block_ngram_repeat > 0 and cur_len > 1:
-            for path_idx in range(self.alive_seq.shape[0]):
-                # skip BOS
-                hyp = self.alive_seq[path_idx, 1:]
-                ngrams = set()
-                fail = False
-                gram = []
-                for i in range(cur_len - 1):
-                    # Last n tokens, n = block_ngram_repeat
-                    gram = (gram + [hyp[i].item()])[-self.block_ngram_repeat:]
-                    # skip the blocking if any token in gram is excluded
-                    if set(gram) & self.exclusion_tokens:
-                        continue
-                    if tuple(gram) in ngrams:
-                        fail = True
-                    ngrams.add(tuple(gram))
-                if fail:
-                    log_probs[path_idx] = -10e20
+        """Block every path whose hypothesis repeats an n-gram.
+
+        Each n-gram is compared against the earlier ones of its path once,
+        when it is the newest, and the outcome is accumulated in a per-path
+        flag. Subclasses keep the flag aligned with ``alive_seq`` through
+        :func:`reorder_ngram_state`.
+        """
+        n = self.block_ngram_repeat
+        # skip BOS
+        hyp = self.alive_seq[:, 1:]
+        if n <= 0 or hyp.size(1) <= n:
+            return
+        newest = hyp[:, -n:]
+        # shape: (paths, grams, n)
+        earlier = hyp[:, :-1].unfold(1, n, 1)
+        repeated = earlier.eq(newest.unsqueeze(1)).all(-1)
+        if self.exclusion_tokens:
+            # grams containing an excluded token may repeat
+            repeated &= self._is_excluded(earlier).eq(0)
+            repeated &= self._is_excluded(newest).eq(0).unsqueeze(1)
+        repeated = repeated.any(1)
+        if self._repeated_ngram is None:
+            self._repeated_ngram = repeated
+        else:
+            self._repeated_ngram |= repeated
+        log_probs.masked_fill_(self._repeated_ngram.unsqueeze(1), -10e20)
+
+    def _is_excluded(self, grams):
+        if self._exclusion_idxs is None:
+            self._exclusion_idxs = torch.tensor(
+                sorted(self.exclusion_tokens), dtype=torch.long,
+                device=grams.device)
+        return grams.unsqueeze(-1).eq(self._exclusion_idxs).any(-1).any(-1)
+
+    def reorder_ngram_state(self, select_indices):
+        """Follow the paths selected by ``select_indices`` in ``alive_seq``."""
+        if self._repeated_ngram is not None:
+            self._repeated_ngram = self._repeated_ngram.index_select(
+                0, select_indices)
+
+    def record_dec_out(self, dec_out_attn, backptr=None):
+        """Keep the decoder output of the current step.
+
+        Nothing is copied here: the outputs are only put in order once,
+        by :func:`gather_dec_outputs()`.
+
+        Args:
+            dec_out_attn (Tuple[FloatTensor, dict]): Decoder output and
+                attentions of the step, shaped ``(1, B x parallel_paths, *)``.
+            backptr (LongTensor or NoneType): Shape ``(B x parallel_paths,)``.
+                Row of ``dec_out_attn`` every path continues after this
+                step. ``None`` if the paths keep their rows.
+        """
+        if not self.keep_dec_outputs:
+            return
+        dec_out, dec_attn = dec_out_attn
+        self._dec_out_steps.append(dec_out)
+        for key, value in dec_attn.items():
+            self._dec_attn_steps.setdefault(key, []).append(value)
+        if backptr is not None:
+            if self._backptrs is None:
+                self._backptrs = torch.empty(
+                    [self.max_length, backptr.size(0)],
+                    dtype=torch.long, device=backptr.device)
+            self._backptrs[len(self._dec_out_steps) - 1] = backptr
+
+    def gather_dec_outputs(self):
+        """Return the recorded decoder outputs along the final paths.
+
+        The backpointers are followed from the last step to the first,
+        then every output is gathered once.
+
+        Returns:
+            (FloatTensor, dict[str, FloatTensor]): Decoder output and
+            attentions, shaped ``(step, B x parallel_paths, *)``.
+        """
+        steps = len(self._dec_out_steps)
+        rows = None
+        if self._backptrs is not None:
+            backptrs = self._backptrs[:steps]
+            rows = torch.empty_like(backptrs)
+            path = torch.arange(backptrs.size(1), dtype=torch.long,
+                                device=backptrs.device)
+            for t in range(steps - 1, -1, -1):
+                path = backptrs[t].index_select(0, path)
+                rows[t] = path
+
+        def gather(step_outputs):
+            out = torch.cat(step_outputs, 0)
+            if rows is None:
+                return out
+            index = rows.view(rows.shape + (1,) * (out.dim() - 2))
+            return out.gather(1, index.expand_as(out))
+
+        return (gather(self._dec_out_steps),
+                {key: gather(value)
+                 for key, value in self._dec_attn_steps.items()})
 
     def advance(self, log_probs, attn):
         """DecodeStrategy subclasses should override :func:`advance()`.
@@ -81,16 +81,17 @@ class RandomSampling(DecodeStrategy):
             :func:`~onmt.translate.random_sampling.sample_with_temperature()`.
         memory_length (LongTensor): Lengths of encodings. Used for
             masking attention.
+        keep_dec_outputs (bool): See base.
     """
 
     def __init__(self, pad, bos, eos, batch_size, device,
                  min_length, block_ngram_repeat, exclusion_tokens,
                  return_attention, max_length, sampling_temp, keep_topk,
-                 memory_length):
+                 memory_length, keep_dec_outputs=False):
         super(RandomSampling, self).__init__(
             pad, bos, eos, batch_size, device, 1,
             min_length, block_ngram_repeat, exclusion_tokens,
-            return_attention, max_length)
+            return_attention, max_length, keep_dec_outputs)
         self.sampling_temp = sampling_temp
         self.keep_topk = keep_topk
         self.topk_scores = None
@@ -122,17 +123,7 @@ class RandomSampling(DecodeStrategy):
 
 
 
-        dec_out, dec_attn = dec_out_attn
-        if self.dec_outputs is None:
-            self.dec_outputs = dec_out
-        else:
-            self.dec_outputs = torch.cat((self.dec_outputs, dec_out), 0)
-        for key in dec_attn.keys():
-            if key not in self.dec_attns:
-                self.dec_attns[key] = dec_attn[key]
-            else:
-                self.dec_attns[key] = torch.cat(
-                        [self.dec_attns[key], dec_attn[key]])
+        self.record_dec_out(dec_out_attn)
 
 
         self.is_finished = topk_ids.eq(self.eos)
@@ -166,6 +157,7 @@ class RandomSampling(DecodeStrategy):
         # Remove finished batches for the next step.
             is_alive = ~self.is_finished.view(-1)
             self.alive_seq = self.alive_seq[is_alive]
+            self.reorder_ngram_state(is_alive.nonzero().view(-1))
             if self.alive_attn is not None:
                 self.alive_attn = self.alive_attn[:, is_alive]
             self.select_indices = is_alive.nonzero().view(-1)
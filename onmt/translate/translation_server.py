@@ -8,6 +8,12 @@ import json
 import threading
 import re
 import traceback
+import uuid
+import math
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from six.moves import queue
 
 import torch
 import onmt.opts
@@ -68,10 +74,229 @@ class ServerModelError(Exception):
     pass
 
 
+class _Request(object):
+    """Inputs of a :func:`ServerModel.run()` call waiting in the queue."""
+
+    def __init__(self, texts, histories, passages=None):
+        self.texts = texts
+        self.histories = histories
+        self.passages = passages or [None] * len(texts)
+        self.future = Future()
+        self.enqueue_time = time.time()
+        self.times = {}
+
+
+class Session(object):
+    """A conversation about a passage.
+
+    Keeps the tokenized passage and turns, and the encoding of the
+    passage once the translator computed it (see
+    :func:`onmt.translate.Translator.translate()`).
+    """
+
+    def __init__(self, src):
+        self.src = src
+        # (question, answer) tokenized
+        self.turns = []
+        self.last_question = None
+        self.passage = {}
+        self.last_access = time.time()
+
+    def history(self, n_history):
+        """The last ``n_history`` turns formatted as in preprocessing."""
+        text_list = [] if len(self.turns) > n_history else ["<sos>"]
+        for i, (que, ans) in enumerate(self.turns[-n_history:]):
+            text_list.extend(["q%d" % i, que, "a%d" % i, ans])
+        return " ".join(t for t in text_list if t != "")
+
+
+class SessionStore(object):
+    """Sessions by id, the least recently used ones being evicted beyond
+    ``max_sessions`` and any of them after ``ttl`` seconds unused.
+    """
+
+    def __init__(self, max_sessions=1000, ttl=600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _evict(self):
+        expired = time.time() - self.ttl
+        while len(self.sessions) > 0:
+            session_id, session = next(iter(self.sessions.items()))
+            if len(self.sessions) <= self.max_sessions \
+                    and session.last_access > expired:
+                break
+            del self.sessions[session_id]
+
+    def add(self, session):
+        with self.lock:
+            session_id = uuid.uuid4().hex
+            self.sessions[session_id] = session
+            self._evict()
+            return session_id
+
+    def get(self, session_id):
+        with self.lock:
+            self._evict()
+            if session_id not in self.sessions:
+                raise ServerModelError("No such session '%s'" % session_id)
+            session = self.sessions.pop(session_id)
+            session.last_access = time.time()
+            self.sessions[session_id] = session
+            return session
+
+    def remove(self, session_id):
+        with self.lock:
+            if self.sessions.pop(session_id, None) is None:
+                raise ServerModelError("No such session '%s'" % session_id)
+
+    def clear_encodings(self):
+        """Drop the cached passage encodings, e.g. when the model moves."""
+        with self.lock:
+            for session in self.sessions.values():
+                session.passage.clear()
+
+
+class ResidencyManager(object):
+    """Keep the loaded models within a memory budget.
+
+    Tracks the parameter and buffer bytes of every loaded model. When
+    loading a model would exceed ``budget`` bytes, the least recently
+    used models are unloaded first, skipping those busy translating.
+    Moving a model to CPU does not lower what it takes, so eviction
+    unloads.
+
+    Requests are counted per model in a rate decaying with
+    ``half_life`` seconds, from which :func:`preload_hot()` predicts
+    the models worth loading ahead of their next request.
+
+    Args:
+        budget (int): bytes, no limit if None
+        half_life (float): seconds for the request rates to halve
+        max_events (int): load and evict events kept for monitoring
+    """
+
+    def __init__(self, budget=None, half_life=300, max_events=200):
+        self.budget = budget
+        self.half_life = half_life
+        # model_id -> bytes, estimated while loading
+        self.resident = {}
+        # model_id -> bytes measured at the last load
+        self.footprints = {}
+        # model_id -> last request time, least recent first
+        self.last_used = OrderedDict()
+        # model_id -> (rate, time of the rate)
+        self.rates = {}
+        self.events = deque(maxlen=max_events)
+        self.lock = threading.RLock()
+
+    def _event(self, event, model_id, n_bytes):
+        self.events.append({"time": time.time(), "event": event,
+                            "model_id": model_id, "bytes": n_bytes})
+
+    def resident_bytes(self):
+        return sum(self.resident.values())
+
+    def rate(self, model_id, now=None):
+        """Requests per ``half_life`` of ``model_id``, decayed to ``now``."""
+        rate, then = self.rates.get(model_id, (0.0, 0.0))
+        now = time.time() if now is None else now
+        return rate * math.pow(0.5, (now - then) / self.half_life)
+
+    def touch(self, model_id):
+        """Record a request of ``model_id``."""
+        with self.lock:
+            now = time.time()
+            self.rates[model_id] = (self.rate(model_id, now) + 1, now)
+            self.last_used.pop(model_id, None)
+            self.last_used[model_id] = now
+
+    def reserve(self, model):
+        """Make room for ``model``, about to be loaded."""
+        with self.lock:
+            expected = self.footprints.get(model.model_id,
+                                           model.expected_footprint())
+            self.resident[model.model_id] = expected
+            self._make_room(model)
+
+    def _make_room(self, model):
+        if self.budget is None:
+            return
+        victims = sorted((m for m in model.peers.values()
+                          if m is not model and m.model_id in self.resident),
+                         key=lambda m: self.last_used.get(m.model_id, 0))
+        for victim in victims:
+            if self.resident_bytes() <= self.budget:
+                return
+            n_bytes = self.resident[victim.model_id]
+            if victim.try_unload():
+                self._event("evict", victim.model_id, n_bytes)
+        if self.resident_bytes() > self.budget:
+            self._event("over_budget", model.model_id,
+                        self.resident_bytes())
+
+    def loaded(self, model):
+        with self.lock:
+            n_bytes = model.footprint()
+            self.resident[model.model_id] = n_bytes
+            self.footprints[model.model_id] = n_bytes
+            self._event("load", model.model_id, n_bytes)
+
+    def released(self, model):
+        with self.lock:
+            n_bytes = self.resident.pop(model.model_id, None)
+            if n_bytes is not None:
+                self._event("unload", model.model_id, n_bytes)
+
+    def preload_hot(self, models, min_rate=1.0):
+        """Load the unloaded models whose request rate is at least
+        ``min_rate`` and above that of the models they would evict.
+        """
+        now = time.time()
+        candidates = sorted(
+            (m for m in models.values()
+             if not m.loaded and self.rate(m.model_id, now) >= min_rate),
+            key=lambda m: -self.rate(m.model_id, now))
+        for model in candidates:
+            rate = self.rate(model.model_id, now)
+            with self.lock:
+                expected = self.footprints.get(
+                    model.model_id, model.expected_footprint())
+                room = float("inf") if self.budget is None \
+                    else self.budget - self.resident_bytes()
+                room += sum(n_bytes for model_id, n_bytes
+                            in self.resident.items()
+                            if self.rate(model_id, now) < rate)
+            if expected > room:
+                continue
+            self._event("preload", model.model_id, expected)
+            model.ensure_loaded()
+
+    def to_dict(self):
+        with self.lock:
+            now = time.time()
+            model_ids = set(self.resident) | set(self.rates)
+            return {"budget": self.budget,
+                    "resident_bytes": self.resident_bytes(),
+                    "models": {model_id: {
+                        "resident_bytes": self.resident.get(model_id, 0),
+                        "rate": self.rate(model_id, now),
+                        "last_used": self.last_used.get(model_id)}
+                        for model_id in model_ids},
+                    "events": list(self.events)}
+
+
 class TranslationServer(object):
     def __init__(self):
         self.models = {}
         self.next_id = 0
+        self.residency = ResidencyManager()
+        self.preload_thread = None
 
     def start(self, config_file):
         """Read the config file and pre-/load the models."""
@@ -80,6 +305,10 @@ class TranslationServer(object):
             self.confs = json.load(f)
 
         self.models_root = self.confs.get('models_root', './available_models')
+        budget_mb = self.confs.get('memory_budget_mb', None)
+        self.residency = ResidencyManager(
+            budget=None if budget_mb is None else int(budget_mb * 2 ** 20),
+            half_life=self.confs.get('traffic_half_life', 300))
         for i, conf in enumerate(self.confs["models"]):
             if "models" not in conf:
                 if "model" in conf:
@@ -92,13 +321,35 @@ class TranslationServer(object):
                       'load': conf.get('load', None),
                       'tokenizer_opt': conf.get('tokenizer', None),
                       'on_timeout': conf.get('on_timeout', None),
-                      'model_root': conf.get('model_root', self.models_root)
+                      'model_root': conf.get('model_root', self.models_root),
+                      'max_batch_size': conf.get('max_batch_size', None),
+                      'max_wait_ms': conf.get('max_wait_ms', 5),
+                      'max_sessions': conf.get('max_sessions', None),
+                      'session_ttl': conf.get('session_ttl', None),
+                      'n_history': conf.get('n_history', None)
                       }
             kwargs = {k: v for (k, v) in kwargs.items() if v is not None}
             model_id = conf.get("id", None)
             opt = conf["opt"]
             opt["models"] = conf["models"]
             self.preload_model(opt, model_id=model_id, **kwargs)
+        preload_interval = self.confs.get('preload_interval', 0)
+        if preload_interval > 0:
+            self.preload_thread = threading.Thread(
+                target=self._preload_loop,
+                args=(preload_interval,
+                      self.confs.get('preload_min_rate', 1.0)))
+            self.preload_thread.daemon = True
+            self.preload_thread.start()
+
+    def _preload_loop(self, interval, min_rate):
+        while True:
+            time.sleep(interval)
+            try:
+                self.residency.preload_hot(self.models, min_rate)
+            except Exception:
+                print("Error while preloading models:\n"
+                      + traceback.format_exc())
 
     def clone_model(self, model_id, opt, timeout=-1):
         """Clone a model `model_id`.
@@ -136,6 +387,8 @@ class TranslationServer(object):
                 model_id += 1
             self.next_id = model_id + 1
         print("Pre-loading model %d" % model_id)
+        model_kwargs.setdefault("residency", self.residency)
+        model_kwargs.setdefault("peers", self.models)
         model = ServerModel(opt, model_id, **model_kwargs)
         self.models[model_id] = model
 
@@ -157,6 +410,39 @@ class TranslationServer(object):
             print("Error No such model '%s'" % str(model_id))
             raise ServerModelError("No such model '%s'" % str(model_id))
 
+    def _session_model(self, inputs):
+        model_id = inputs.get("id", 0)
+        if model_id in self.models and self.models[model_id] is not None:
+            return self.models[model_id]
+        raise ServerModelError("No such model '%s'" % str(model_id))
+
+    def open_session(self, inputs):
+        """Open a conversation about a passage
+
+        ``{"id": model_id, "src": "passage"}``, returns the session id.
+        """
+        return self._session_model(inputs).open_session(inputs["src"])
+
+    def run_session(self, inputs):
+        """Generate the next question of a session
+
+        ``{"id": model_id, "session": session_id, "answer": "...",
+        "question": "..."}`` where the answered turn is optional and the
+        question defaults to the last one generated.
+        """
+        return self._session_model(inputs).run_session(
+            inputs["session"], question=inputs.get("question"),
+            answer=inputs.get("answer"))
+
+    def close_session(self, inputs):
+        """Close the session ``{"id": model_id, "session": session_id}``"""
+        self._session_model(inputs).close_session(inputs["session"])
+
+    def residency_stats(self):
+        """Resident bytes per model, request rates and recent load and
+        evict events (see :class:`ResidencyManager`)."""
+        return self.residency.to_dict()
+
     def unload_model(self, model_id):
         """Manually unload a model.
 
@@ -191,10 +477,24 @@ class ServerModel(object):
             timeout (see :func:`do_timeout()`.)
         model_root (str): Path to the model directory
             it must contain the model and tokenizer file
+        max_batch_size (int): Most inputs of concurrent requests
+            translated together, ``opt.batch_size`` if not set
+        max_wait_ms (float): Longest time a request waits for others
+            to share its batch
+        max_sessions (int): Most sessions kept (see :class:`SessionStore`)
+        session_ttl (float): Seconds before an unused session is evicted
+        n_history (int): Turns of a session passed as history, as
+            ``--n_history`` of ``cqg_preprocess.py``
+        residency (ResidencyManager): Keeps the models of the server
+            within its memory budget, None to load without it
+        peers (dict): Models of the server by id, those ``residency``
+            may evict to load this one
     """
 
     def __init__(self, opt, model_id, tokenizer_opt=None, load=False,
-                 timeout=-1, on_timeout="to_cpu", model_root="./"):
+                 timeout=-1, on_timeout="to_cpu", model_root="./",
+                 max_batch_size=None, max_wait_ms=5, max_sessions=1000,
+                 session_ttl=600, n_history=5, residency=None, peers=None):
         self.model_root = model_root
         self.opt = self.parse_opt(opt)
         if self.opt.n_best > 1:
@@ -220,6 +520,21 @@ class ServerModel(object):
         self.loading_lock.set()
         self.running_lock = threading.Semaphore(value=1)
 
+        self.max_batch_size = max_batch_size or self.opt.batch_size
+        self.max_wait_ms = max_wait_ms
+        # batch size -> number of batches
+        self.batch_sizes = {}
+        self.queue = queue.Queue()
+        self.batch_thread = threading.Thread(target=self._batch_loop)
+        self.batch_thread.daemon = True
+        self.batch_thread.start()
+
+        self.sessions = SessionStore(max_sessions, session_ttl)
+        self.n_history = n_history
+
+        self.residency = residency
+        self.peers = peers if peers is not None else {}
+
         set_random_seed(self.opt.seed, self.opt.cuda)
 
         if load:
@@ -274,12 +589,19 @@ class ServerModel(object):
         self.logger.info("Loading model %d" % self.model_id)
         timer.start()
 
+        if self.residency is not None:
+            self.residency.reserve(self)
         try:
             self.translator = build_translator(self.opt,
                                                report_score=False,
                                                out_file=open(os.devnull, "w"))
         except RuntimeError as e:
+            if self.residency is not None:
+                self.residency.released(self)
+            self.loading_lock.set()
             raise ServerModelError("Runtime Error: %s" % str(e))
+        if self.residency is not None:
+            self.residency.loaded(self)
 
         timer.tick("model_loading")
         if self.tokenizer_opt is not None:
@@ -324,42 +646,30 @@ class ServerModel(object):
         self.reset_unload_timer()
         self.loading_lock.set()
 
-    @critical
     def run(self, inputs):
         """Translate `inputs` using this model
 
+        The inputs are queued and translated together with those of
+        concurrent calls (see :func:`_batch_loop()`).
+
         Args:
-            inputs (List[dict[str, str]]): [{"src": "..."},{"src": ...}]
+            inputs (List[dict[str, str]]): [{"src": "...", "history": "..."},
+                {"src": ...}]
 
         Returns:
             result (list): translations
-            times (dict): containing times
+            times (dict): containing times, the ``queue_depth`` met by
+                the request, its ``queue_delay`` and the size of the
+                batch it was translated in
         """
 
-        self.stop_unload_timer()
-
         timer = Timer()
         timer.start()
 
         self.logger.info("Running translation using %d" % self.model_id)
 
-        if not self.loading_lock.is_set():
-            self.logger.info(
-                "Model #%d is being loaded by another thread, waiting"
-                % self.model_id)
-            if not self.loading_lock.wait(timeout=30):
-                raise ServerModelError("Model %d loading timeout"
-                                       % self.model_id)
-
-        else:
-            if not self.loaded:
-                self.load()
-                timer.tick(name="load")
-            elif self.opt.cuda:
-                self.to_gpu()
-                timer.tick(name="to_gpu")
-
         texts = []
+        histories = []
         head_spaces = []
         tail_spaces = []
         sslength = []
@@ -368,6 +678,7 @@ class ServerModel(object):
             if src.strip() == "":
                 head_spaces.append(src)
                 texts.append("")
+                histories.append("")
                 tail_spaces.append("")
             else:
                 whitespaces_before, whitespaces_after = "", ""
@@ -380,35 +691,25 @@ class ServerModel(object):
                 head_spaces.append(whitespaces_before)
                 tok = self.maybe_tokenize(src.strip())
                 texts.append(tok)
+                histories.append(
+                    self.maybe_tokenize(inp.get('history', '').strip()))
                 sslength.append(len(tok.split()))
                 tail_spaces.append(whitespaces_after)
 
         empty_indices = [i for i, x in enumerate(texts) if x == ""]
-        texts_to_translate = [x for x in texts if x != ""]
+        to_translate = [(x, h) for x, h in zip(texts, histories) if x != ""]
 
         scores = []
         predictions = []
-        if len(texts_to_translate) > 0:
-            try:
-                scores, predictions = self.translator.translate(
-                    texts_to_translate,
-                    batch_size=self.opt.batch_size)
-            except (RuntimeError, Exception) as e:
-                err = "Error: %s" % str(e)
-                self.logger.error(err)
-                self.logger.error("repr(text_to_translate): "
-                                  + repr(texts_to_translate))
-                self.logger.error("model: #%s" % self.model_id)
-                self.logger.error("model opt: " + str(self.opt.__dict__))
-                self.logger.error(traceback.format_exc())
-
-                raise ServerModelError(err)
+        if len(to_translate) > 0:
+            scores, predictions = self._submit(
+                _Request([x for x, _ in to_translate],
+                         [h for _, h in to_translate]), timer)
+        timer.tick(name="total", tot=True)
 
-        timer.tick(name="translation")
         self.logger.info("""Using model #%d\t%d inputs
                \ttranslation time: %f""" % (self.model_id, len(texts),
-                                            timer.times['translation']))
-        self.reset_unload_timer()
+                                            timer.times.get('translation', 0)))
 
         # NOTE: translator returns lists of `n_best` list
         #       we can ignore that (i.e. flatten lists) only because
@@ -432,6 +733,175 @@ class ServerModel(object):
         self.logger.info("Translation Results: %d", len(results))
         return results, scores, self.opt.n_best, timer.times
 
+    def _submit(self, request, timer):
+        """Queue ``request`` and wait for its scores and predictions."""
+        timer.times["queue_depth"] = self.queue.qsize()
+        self.queue.put(request)
+        scores, predictions = request.future.result()
+        timer.times.update(request.times)
+        return scores, predictions
+
+    def open_session(self, src):
+        """Start a conversation about the passage ``src``.
+
+        Returns:
+            session_id (str)
+        """
+        return self.sessions.add(Session(self.maybe_tokenize(src.strip())))
+
+    def run_session(self, session_id, question=None, answer=None):
+        """Generate the next question of a session.
+
+        The passage is tokenized once per session and its encoding
+        computed on the first turn only, the history being encoded
+        again at each turn.
+
+        Args:
+            session_id (str): as returned by :func:`open_session()`
+            question (str): question of the turn answered, the last
+                question generated if not set
+            answer (str): answer of the turn, no new turn if not set
+
+        Returns:
+            result (str): next question
+            score (float)
+            times (dict): as :func:`run()`
+        """
+        timer = Timer()
+        timer.start()
+        session = self.sessions.get(session_id)
+        if answer is not None:
+            if question is not None:
+                question = self.maybe_tokenize(question.strip())
+            elif session.last_question is not None:
+                question = session.last_question
+            else:
+                raise ServerModelError(
+                    "Session '%s' has no question to answer" % session_id)
+            session.turns.append(
+                (question, self.maybe_tokenize(answer.strip())))
+        scores, predictions = self._submit(
+            _Request([session.src], [session.history(self.n_history)],
+                     [session.passage]), timer)
+        session.last_question = predictions[0][0]
+        timer.tick(name="total", tot=True)
+        return (self.maybe_detokenize(predictions[0][0]),
+                scores[0][0].item(), timer.times)
+
+    def close_session(self, session_id):
+        self.sessions.remove(session_id)
+
+    def _batch_loop(self):
+        """Translate the queued requests in batches.
+
+        A batch is closed when it holds ``max_batch_size`` inputs or
+        ``max_wait_ms`` after its first request, requests are never split.
+        """
+        carry = None
+        while True:
+            request = carry if carry is not None else self.queue.get()
+            carry = None
+            batch = [request]
+            n_inputs = len(request.texts)
+            deadline = time.time() + self.max_wait_ms / 1000.0
+            while n_inputs < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if n_inputs + len(request.texts) > self.max_batch_size:
+                    carry = request
+                    break
+                batch.append(request)
+                n_inputs += len(request.texts)
+            self._run_batch(batch, n_inputs)
+
+    def _run_batch(self, batch, n_inputs):
+        """Translate ``batch`` at once and scatter the results."""
+        start = time.time()
+        self.batch_sizes[n_inputs] = self.batch_sizes.get(n_inputs, 0) + 1
+        texts = sum((request.texts for request in batch), [])
+        histories = sum((request.histories for request in batch), [])
+        passages = sum((request.passages for request in batch), [])
+        try:
+            scores, predictions, times = self._translate(
+                texts, histories, passages)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        offset = 0
+        for request in batch:
+            n = len(request.texts)
+            request.times = dict(times,
+                                 queue_delay=start - request.enqueue_time,
+                                 batch_size=n_inputs)
+            request.future.set_result((scores[offset:offset + n],
+                                       predictions[offset:offset + n]))
+            offset += n
+
+    @critical
+    def _translate(self, texts, histories, passages):
+        """Translate a batch of tokenized inputs, loading the model first
+        if needed.
+
+        ``passages`` are the passage caches of the session inputs, None
+        for the others.
+
+        Returns:
+            scores (list), predictions (list): as ``Translator.translate``
+            times (dict): containing times
+        """
+
+        self.stop_unload_timer()
+        if self.residency is not None:
+            self.residency.touch(self.model_id)
+
+        timer = Timer()
+        timer.start()
+
+        if not self.loading_lock.is_set():
+            self.logger.info(
+                "Model #%d is being loaded by another thread, waiting"
+                % self.model_id)
+            if not self.loading_lock.wait(timeout=30):
+                raise ServerModelError("Model %d loading timeout"
+                                       % self.model_id)
+
+        else:
+            if not self.loaded:
+                self.load()
+                timer.tick(name="load")
+            elif self.opt.cuda:
+                self.to_gpu()
+                timer.tick(name="to_gpu")
+
+        try:
+            scores, predictions = self.translator.translate(
+                src=texts,
+                history=histories,
+                batch_size=self.opt.batch_size,
+                batch_type=self.opt.batch_type,
+                passages=passages if any(
+                    p is not None for p in passages) else None)
+        except (RuntimeError, Exception) as e:
+            err = "Error: %s" % str(e)
+            self.logger.error(err)
+            self.logger.error("repr(text_to_translate): "
+                              + repr(texts))
+            self.logger.error("model: #%s" % self.model_id)
+            self.logger.error("model opt: " + str(self.opt.__dict__))
+            self.logger.error(traceback.format_exc())
+
+            raise ServerModelError(err)
+
+        timer.tick(name="translation")
+        self.reset_unload_timer()
+        return scores, predictions, timer.times
+
     def do_timeout(self):
         """Timeout function that frees GPU memory.
 
@@ -449,12 +919,55 @@ class ServerModel(object):
 
     @critical
     def unload(self):
+        self._unload()
+
+    def _unload(self):
         self.logger.info("Unloading model %d" % self.model_id)
+        self.stop_unload_timer()
+        self.sessions.clear_encodings()
         del self.translator
+        if self.residency is not None:
+            self.residency.released(self)
         if self.opt.cuda:
             torch.cuda.empty_cache()
         self.unload_timer = None
 
+    def try_unload(self):
+        """Unload the model unless it is translating or not loaded.
+
+        Returns:
+            whether the model was unloaded
+        """
+        if not self.running_lock.acquire(False):
+            return False
+        try:
+            if not self.loaded or not self.loading_lock.is_set():
+                return False
+            self._unload()
+            return True
+        finally:
+            self.running_lock.release()
+
+    @critical
+    def ensure_loaded(self):
+        """Load the model ahead of its requests."""
+        if not self.loaded and self.loading_lock.is_set():
+            self.load()
+
+    def footprint(self):
+        """Bytes of the parameters and buffers of the loaded model."""
+        model = self.translator.model
+        # exported models keep their tensors in the traced module
+        module = getattr(model, "module", model)
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def expected_footprint(self):
+        """Bytes the model is expected to take before its first load,
+        the size of its checkpoints."""
+        return sum(os.path.getsize(path) for path in self.opt.models
+                   if os.path.exists(path))
+
     def stop_unload_timer(self):
         if self.unload_timer is not None:
             self.unload_timer.cancel()
@@ -475,6 +988,13 @@ class ServerModel(object):
              "models": self.user_opt["models"],
              "loaded": self.loaded,
              "timeout": self.timeout,
+             "batching": {"max_batch_size": self.max_batch_size,
+                          "max_wait_ms": self.max_wait_ms,
+                          "queue_depth": self.queue.qsize(),
+                          "batch_sizes": self.batch_sizes},
+             "sessions": len(self.sessions),
+             "resident_bytes": self.residency.resident.get(self.model_id, 0)
+             if self.residency is not None else None,
              }
         if self.tokenizer_opt is not None:
             d["tokenizer"] = self.tokenizer_opt
@@ -483,6 +1003,7 @@ class ServerModel(object):
     @critical
     def to_cpu(self):
         """Move the model to CPU and clear CUDA cache."""
+        self.sessions.clear_encodings()
         self.translator.model.cpu()
         if self.opt.cuda:
             torch.cuda.empty_cache()
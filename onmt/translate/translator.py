@@ -4,8 +4,11 @@ from __future__ import print_function
 import codecs
 import os
 import math
+import time
 
 import torch
+import torch.nn as nn
+import torch.nn.functional as F
 
 from tqdm import tqdm
 import onmt.model_builder
@@ -14,7 +17,8 @@ import onmt.inputters as inputters
 from onmt.translate.beam_search import BeamSearch
 from onmt.translate.random_sampling import RandomSampling
 from onmt.utils.misc import tile, set_random_seed
-from onmt.modules.copy_generator import collapse_copy_scores
+from onmt.modules.copy_generator import CopyGenerator, \
+    collapse_copy_scores, _collapse_index
 
 
 def wrap_translator(model, fields, opt, model_opt, report_score=True, logger=None, out_file=None):
@@ -40,6 +44,8 @@ def build_translator(opt, report_score=True, logger=None, out_file=None):
 
     load_test_model = onmt.model_builder.load_test_model
     fields, model, model_opt = load_test_model(opt)
+    if opt.encoder_branch_threads > 0:
+        model.encoder.set_branch_threads(opt.encoder_branch_threads)
 
     scorer = onmt.translate.GNMTGlobalScorer.from_opt(opt)
 
@@ -95,6 +101,11 @@ class Translator(object):
         out_file (TextIO or codecs.StreamReaderWriter): Output file.
         report_score (bool) : Whether to report scores
         logger (logging.Logger or NoneType): Logger.
+        vocab_shortlist (int): Score only the passage and history words,
+            this many most frequent target words and the special tokens
+            when decoding outside training. 0 scores the whole vocabulary.
+        beam_bound_stopping (bool): See
+            :class:`onmt.translate.beam_search.BeamSearch` ``bound_stopping``.
     """
 
     def __init__(
@@ -126,7 +137,9 @@ class Translator(object):
             out_file=None,
             report_score=True,
             logger=None,
-            seed=-1):
+            seed=-1,
+            vocab_shortlist=0,
+            beam_bound_stopping=False):
         self.model = model
         self.fields = fields
         tgt_field = dict(self.fields)["tgt"].base_field
@@ -193,6 +206,21 @@ class Translator(object):
                 "scores": [],
                 "log_probs": []}
 
+        self.beam_bound_stopping = beam_bound_stopping
+        self.vocab_shortlist = vocab_shortlist
+        if self.vocab_shortlist > 0:
+            if not isinstance(self._generator_linear(), nn.Linear):
+                raise ValueError(
+                    "vocab_shortlist requires the float generator of a "
+                    "checkpoint.")
+            # tgt ids of the src and history vocabularies, unk if absent
+            self._to_tgt_ids = {}
+            for side in ["src", "history"]:
+                vocab = dict(self.fields)[side].base_field.vocab
+                self._to_tgt_ids[side] = torch.tensor(
+                    [self._tgt_vocab.stoi[w] for w in vocab.itos],
+                    dtype=torch.long, device=self._dev)
+
         set_random_seed(seed, self._use_cuda)
 
     @classmethod
@@ -253,7 +281,10 @@ class Translator(object):
             out_file=out_file,
             report_score=report_score,
             logger=logger,
-            seed=opt.seed)
+            seed=opt.seed,
+            # not a training option, the RL search uses no shortlist
+            vocab_shortlist=getattr(opt, "vocab_shortlist", 0),
+            beam_bound_stopping=getattr(opt, "beam_bound_stopping", False))
 
     def _build_target_tokens(self, src, src_vocab, src_raw, pred, attn):
         tgt_field = dict(self.fields)["tgt"].base_field
@@ -274,6 +305,58 @@ class Translator(object):
                     tokens[i] = src_raw[max_index.item()]
         return tokens
 
+    def _generator_linear(self):
+        generator = self.model.generator
+        if isinstance(generator, CopyGenerator):
+            return generator.linear
+        if isinstance(generator, nn.Sequential):
+            return generator[0]
+        return None
+
+    def _build_shortlist(self, batch, src_vocabs):
+        """Target ids the generator scores for ``batch``.
+
+        Returns:
+            (LongTensor, LongTensor): the sorted shortlist ``ids``, the
+            specials keeping their own position, and the ``index`` of
+            every target id in it, -1 if left out.
+        """
+        n_frequent = max(self.vocab_shortlist, 1 + max(
+            self._tgt_unk_idx, self._tgt_pad_idx, self._tgt_bos_idx,
+            self._tgt_eos_idx))
+        # itos is sorted by frequency after the specials
+        candidates = [torch.arange(min(n_frequent, self._tgt_vocab_len),
+                                   dtype=torch.long, device=self._dev)]
+        for side in ["src", "history"]:
+            data = getattr(batch, side)
+            data = data[0] if isinstance(data, tuple) else data
+            candidates.append(self._to_tgt_ids[side].index_select(
+                0, data[:, :, 0].contiguous().view(-1)))
+        if self.copy_attn:
+            # words copied from the source, including out of src vocab ones
+            _, fill, _ = _collapse_index(batch, self._tgt_vocab, src_vocabs)
+            candidates.append(fill.view(-1))
+        ids = torch.unique(torch.cat(candidates), sorted=True)
+        index = ids.new_full((self._tgt_vocab_len,), -1)
+        index[ids] = torch.arange(ids.size(0), dtype=torch.long,
+                                  device=ids.device)
+        return ids, index
+
+    def _from_shortlist(self, pred, shortlist):
+        """Maps shortlist (and copy) positions back to target ids."""
+        n = shortlist.size(0)
+        in_shortlist = shortlist.index_select(
+            0, pred.clamp(max=n - 1).contiguous().view(-1)).view_as(pred)
+        return torch.where(pred.lt(n), in_shortlist,
+                           pred - n + self._tgt_vocab_len)
+
+    def _shortlist_exclusion(self, shortlist):
+        if not self._exclusion_idxs:
+            return self._exclusion_idxs
+        index = shortlist[1][torch.tensor(sorted(self._exclusion_idxs),
+                                          device=shortlist[1].device)]
+        return {i for i in index.tolist() if i >= 0}
+
     def _log(self, msg):
         if self.logger:
             self.logger.info(msg)
@@ -281,8 +364,9 @@ class Translator(object):
             print(msg)
 
     def _gold_score(self, batch, memory_bank, src_lengths, src_vocabs,
-                    use_src_map, enc_states, batch_size, src):
-        if "tgt" in batch.__dict__:
+                    use_src_map, enc_states, batch_size, src, training=False):
+        # nothing reads the gold score of a training batch
+        if "tgt" in batch.__dict__ and not training:
             gs = self._score_target(
                 batch, memory_bank, src_lengths, src_vocabs,
                 batch.src_map if use_src_map else None)
@@ -298,7 +382,9 @@ class Translator(object):
             tgt=None,
             src_dir=None,
             batch_size=None,
-            attn_debug=False):
+            attn_debug=False,
+            batch_type="sents",
+            passages=None):
         """Translate content of ``src`` and get gold scores from ``tgt``.
 
         Args:
@@ -308,6 +394,13 @@ class Translator(object):
                 for certain types of data).
             batch_size (int): size of examples per mini-batch
             attn_debug (bool): enables the attention logging
+            batch_type (str): ``"sents"`` batches the examples in order,
+                ``"tokens"`` buckets them by length and ``batch_size``
+                then bounds the src and history tokens of a batch,
+                padding included. Outputs keep the input order either way.
+            passages (list): optional dicts, one per example of ``src``
+                or None, caching the encoding of its passage across
+                calls (see :func:`_encode_with_passages()`)
 
         Returns:
             (`list`, `list`)
@@ -331,15 +424,28 @@ class Translator(object):
             filter_pred=self._filter_pred
         )
 
-        data_iter = inputters.OrderedIterator(
-            dataset=data,
-            device=self._dev,
-            batch_size=batch_size,
-            train=False,
-            sort=False,
-            sort_within_batch=True,
-            shuffle=False
-        )
+        if batch_type == "tokens":
+            data_iter = inputters.OrderedIterator(
+                dataset=data,
+                device=self._dev,
+                batch_size=batch_size,
+                batch_size_fn=inputters.max_src_history_tok_len,
+                train=False,
+                sort=True,
+                sort_key=inputters.src_history_sort_key,
+                sort_within_batch=True,
+                shuffle=False
+            )
+        else:
+            data_iter = inputters.OrderedIterator(
+                dataset=data,
+                device=self._dev,
+                batch_size=batch_size,
+                train=False,
+                sort=False,
+                sort_within_batch=True,
+                shuffle=False
+            )
 
         xlation_builder = onmt.translate.TranslationBuilder(
             data, self.fields, self.n_best, self.replace_unk, tgt
@@ -351,29 +457,115 @@ class Translator(object):
 
         all_scores = []
         all_predictions = []
+        padding = {"tokens": 0, "padded": 0}
+
+        start_time = time.time()
+        for trans in self._translate_in_order(
+                data_iter, data, xlation_builder, attn_debug, padding,
+                passages):
+            all_scores += [trans.pred_scores[:self.n_best]]
+            pred_score_total += trans.pred_scores[0]
+            pred_words_total += len(trans.pred_sents[0])
+            if tgt is not None:
+                gold_score_total += trans.gold_score
+                gold_words_total += len(trans.gold_sent) + 1
+
+            n_best_preds = [" ".join(pred)
+                            for pred in trans.pred_sents[:self.n_best]]
+            all_predictions += [n_best_preds]
+            if self.out_file is not None:
+                self.out_file.write('\n'.join(n_best_preds) + '\n')
+                self.out_file.flush()
+
+        if self.report_time or batch_type == "tokens":
+            total_time = time.time() - start_time
+            self._log("Translated %d sentences in %.1fs, %.2f sents/sec, "
+                      "src and history padding efficiency %.1f%%"
+                      % (len(all_predictions), total_time,
+                         len(all_predictions) / max(total_time, 1e-6),
+                         100.0 * padding["tokens"]
+                         / max(padding["padded"], 1)))
+
+        return all_scores, all_predictions
 
+    def _translate_in_order(self, data_iter, data, xlation_builder,
+                            attn_debug, padding, passages=None):
+        """Translate the batches of ``data_iter``, yielding the translations
+        in the order of the examples of ``data``.
+
+        The real and padded src and history tokens of the batches are
+        added up in ``padding``.
+        """
+        if not hasattr(self.model.encoder, "encode_passage"):
+            passages = None
+        pending, next_index = {}, 0
         for batch in tqdm(data_iter, total=len(data_iter)):
+            for side in ["src", "history"]:
+                side_data = getattr(batch, side)
+                if isinstance(side_data, tuple):
+                    seq, lengths = side_data
+                    padding["tokens"] += lengths.sum().item()
+                    padding["padded"] += seq.size(0) * batch.batch_size
+            enc_out = None
+            if passages is not None:
+                with torch.no_grad():
+                    enc_out = self._encode_with_passages(batch, passages)
             batch_data = self.translate_batch(
-                batch, data.src_vocabs, attn_debug
+                batch, data.src_vocabs, attn_debug, enc_out=enc_out
             )
+            # from_batch orders the translations by example index
             translations = xlation_builder.from_batch(batch_data)
-
-            for trans in translations:
-                all_scores += [trans.pred_scores[:self.n_best]]
-                pred_score_total += trans.pred_scores[0]
-                pred_words_total += len(trans.pred_sents[0])
-                if tgt is not None:
-                    gold_score_total += trans.gold_score
-                    gold_words_total += len(trans.gold_sent) + 1
-
-                n_best_preds = [" ".join(pred)
-                                for pred in trans.pred_sents[:self.n_best]]
-                all_predictions += [n_best_preds]
-                if self.out_file is not None:
-                    self.out_file.write('\n'.join(n_best_preds) + '\n')
-                    self.out_file.flush()
-
-        return all_scores, all_predictions
+            pending.update(zip(sorted(batch.indices.tolist()), translations))
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+        # examples filtered out leave gaps
+        for index in sorted(pending):
+            yield pending[index]
+
+    def _encode_with_passages(self, batch, passages):
+        """Run the encoder on ``batch``, reusing cached passage encodings.
+
+        ``passages`` holds a dict, or None, per example index. When every
+        example of the batch has its passage encoding cached under
+        ``"encoding"``, only the history side is encoded. Otherwise the
+        passages of the batch are encoded and cached in the dicts.
+        """
+        src, src_lengths = batch.src
+        history, history_lengths = batch.history
+        indices = batch.indices.tolist()
+        cached = [passages[i].get("encoding")
+                  if passages[i] is not None else None for i in indices]
+        if all(encoding is not None for encoding in cached):
+            states, banks = zip(*cached)
+            enc_state = self._cat_passage_states(states)
+            memory_bank = banks[0].new_zeros(
+                src.size(0), len(banks), banks[0].size(2))
+            for b, bank in enumerate(banks):
+                memory_bank[:bank.size(0), b] = bank[:, 0]
+            passage = (enc_state, memory_bank, src_lengths)
+        else:
+            passage = self.model.encoder.encode_passage(src, src_lengths)
+            enc_state, memory_bank, _ = passage
+            for b, i in enumerate(indices):
+                if passages[i] is not None:
+                    passages[i]["encoding"] = (
+                        self._slice_passage_state(enc_state, b),
+                        memory_bank[:src_lengths[b], b:b + 1].detach())
+        return self.model.encoder(src, history, src_lengths,
+                                  history_lengths, passage=passage)
+
+    @staticmethod
+    def _slice_passage_state(enc_state, b):
+        if isinstance(enc_state, tuple):  # LSTM
+            return tuple(h[:, b:b + 1].detach() for h in enc_state)
+        return enc_state[:, b:b + 1].detach()
+
+    @staticmethod
+    def _cat_passage_states(states):
+        if isinstance(states[0], tuple):  # LSTM
+            return tuple(torch.cat(hs, 1) for hs in zip(*states))
+        return torch.cat(states, 1)
 
     def reverse(self, src_vocabs, examples, translation_batch):
         batch = translation_batch["batch"]
@@ -414,14 +606,13 @@ class Translator(object):
             sampling_temp=1.0,
             keep_topk=-1,
             return_attention=False,
-            training=False):
+            training=False,
+            enc_out=None,
+            keep_dec_outputs=False):
         """Alternative to beam search. Do random sampling at each step."""
 
         assert self.beam_size == 1
 
-        # TODO: support these blacklisted features.
-        assert self.block_ngram_repeat == 0
-
         batch_size = batch.batch_size
         beam_size = self.beam_size
 
@@ -432,7 +623,8 @@ class Translator(object):
 
 
         # Encoder forward.
-        src, enc_states, memory_bank, src_lengths = self._run_encoder(batch)
+        src, enc_states, memory_bank, src_lengths = self._run_encoder(
+            batch, enc_out)
         self.model.decoder.init_state(src, memory_bank, enc_states)
 
         use_src_map = self.copy_attn
@@ -444,7 +636,13 @@ class Translator(object):
             "batch": batch,
             "gold_score": self._gold_score(
                 batch, memory_bank, src_lengths, src_vocabs, use_src_map,
-                enc_states, batch_size, src)}
+                enc_states, batch_size, src, training=training)}
+
+        shortlist = None
+        exclusion_tokens = self._exclusion_idxs
+        if self.vocab_shortlist > 0 and not training:
+            shortlist = self._build_shortlist(batch, src_vocabs)
+            exclusion_tokens = self._shortlist_exclusion(shortlist)
 
         memory_lengths = src_lengths
         src_map = batch.src_map if use_src_map else None
@@ -457,8 +655,9 @@ class Translator(object):
         random_sampler = RandomSampling(
             self._tgt_pad_idx, self._tgt_bos_idx, self._tgt_eos_idx,
             batch_size, mb_device, min_length, self.block_ngram_repeat,
-            self._exclusion_idxs, return_attention, self.max_length,
-            sampling_temp, keep_topk, memory_lengths)
+            exclusion_tokens, return_attention, self.max_length,
+            sampling_temp, keep_topk, memory_lengths,
+            keep_dec_outputs=keep_dec_outputs)
 
         for step in range(max_length):
             # Shape: (1, B, 1)
@@ -472,7 +671,8 @@ class Translator(object):
                 memory_lengths=memory_lengths,
                 src_map=src_map,
                 step=step,
-                batch_offset=random_sampler.select_indices
+                batch_offset=random_sampler.select_indices,
+                shortlist=shortlist
             )
 
             random_sampler.advance(log_probs, attn, dec_out_attn)
@@ -500,23 +700,43 @@ class Translator(object):
 
                 self.model.decoder.map_state(
                     lambda state, dim: state.index_select(dim, select_indices))
+                self.model.decoder.map_memory_state(
+                    lambda state, dim: state.index_select(dim, select_indices))
 
         results["scores"] = random_sampler.scores
         results["predictions"] = random_sampler.predictions
+        if shortlist is not None:
+            results["predictions"] = [
+                [self._from_shortlist(pred, shortlist[0]) for pred in preds]
+                for preds in results["predictions"]]
         results["attention"] = random_sampler.attention
 
         # results["hypotheses"] = random_sampler.hypotheses
-        if training:
-            results["dec_outputs"] = random_sampler.dec_outputs.view(max_length, batch_size, beam_size, -1)
-            results["dec_attns"] = random_sampler.dec_attns
+        if keep_dec_outputs:
+            dec_outputs, dec_attns = random_sampler.gather_dec_outputs()
+            results["dec_outputs"] = dec_outputs.view(max_length, batch_size, beam_size, -1)
+            results["dec_attns"] = dec_attns
             for key in results["dec_attns"]:
                 results["dec_attns"][key] = results["dec_attns"][key].view(max_length, batch_size, beam_size, -1)
             assert max_length == batch.tgt.size(0) - 1, "max_length {}, tgt {}".format(max_length, batch.tgt.size())
         return results
 
-    def translate_batch(self, batch, src_vocabs, attn_debug, training=False):
-        """Translate a batch of sentences."""
-        grad_control = torch.enable_grad if training else torch.no_grad
+    def translate_batch(self, batch, src_vocabs, attn_debug, training=False,
+                        enc_out=None, keep_dec_outputs=None):
+        """Translate a batch of sentences.
+
+        ``enc_out`` is the ``(enc_state, memory_bank, lengths)`` output of
+        ``self.model.encoder`` on ``batch``, if it was already computed.
+
+        ``keep_dec_outputs`` (``training`` by default) returns the decoder
+        outputs of the search under ``"dec_outputs"`` and ``"dec_attns"``,
+        with their graph. Without them a training search runs without
+        autograd.
+        """
+        if keep_dec_outputs is None:
+            keep_dec_outputs = training
+        grad_control = torch.enable_grad if training and keep_dec_outputs \
+            else torch.no_grad
         with grad_control():
             if self.beam_size == 1:
                 return self._translate_random_sampling(
@@ -527,7 +747,9 @@ class Translator(object):
                     sampling_temp=self.random_sampling_temp,
                     keep_topk=self.sample_from_topk,
                     return_attention=attn_debug or self.replace_unk,
-                    training=training)
+                    training=training,
+                    enc_out=enc_out,
+                    keep_dec_outputs=keep_dec_outputs)
             else:
                 return self._translate_batch(
                     batch,
@@ -536,16 +758,21 @@ class Translator(object):
                     min_length=self.min_length,
                     n_best=self.n_best,
                     return_attention=attn_debug or self.replace_unk,
-                    training=training)
+                    training=training,
+                    enc_out=enc_out,
+                    keep_dec_outputs=keep_dec_outputs)
 
-    def _run_encoder(self, batch):
+    def _run_encoder(self, batch, enc_out=None):
         src, src_lengths = batch.src if isinstance(batch.src, tuple) \
                            else (batch.src, None)
 
-        history, history_lengths = batch.history if isinstance(batch.history, tuple) else (batch.history, None)
-
-        enc_states, memory_bank, src_lengths = self.model.encoder(
-            src, history, src_lengths, history_lengths)
+        if enc_out is not None:
+            enc_states, memory_bank, src_lengths = enc_out
+        else:
+            history, history_lengths = batch.history \
+                if isinstance(batch.history, tuple) else (batch.history, None)
+            enc_states, memory_bank, src_lengths = self.model.encoder(
+                src, history, src_lengths, history_lengths)
         if src_lengths is None:
             assert not isinstance(memory_bank, tuple), \
                 'Ensemble decoding only supported for text data'
@@ -564,7 +791,11 @@ class Translator(object):
             memory_lengths,
             src_map=None,
             step=None,
-            batch_offset=None):
+            batch_offset=None,
+            shortlist=None,
+            beam_size=None):
+        if shortlist is not None:
+            decoder_in = self._from_shortlist(decoder_in, shortlist[0])
         if self.copy_attn:
             # Turn any copied words into UNKs.
             decoder_in = decoder_in.masked_fill(
@@ -585,14 +816,29 @@ class Translator(object):
                 attn = dec_attn["std"]
             else:
                 attn = None
-            log_probs = self.model.generator(dec_out.squeeze(0))
+            if shortlist is None:
+                log_probs = self.model.generator(dec_out.squeeze(0))
+            else:
+                linear = self._generator_linear()
+                log_probs = F.linear(
+                    dec_out.squeeze(0),
+                    linear.weight.index_select(0, shortlist[0]),
+                    linear.bias.index_select(0, shortlist[0]))
+                for layer in list(self.model.generator)[1:]:
+                    log_probs = layer(log_probs)
             # returns [(batch_size x beam_size) , vocab ] when 1 step
             # or [ tgt_len, batch_size, vocab ] when full sentence
         else:
             attn = dec_attn["copy"]
+            # the extra arguments are left out for generators without them
+            kwargs = {}
+            if shortlist is not None:
+                kwargs["shortlist"] = shortlist[0]
+            if beam_size is not None:
+                kwargs["beam_size"] = beam_size
             scores = self.model.generator(dec_out.view(-1, dec_out.size(2)),
                                           attn.view(-1, attn.size(2)),
-                                          src_map)
+                                          src_map, **kwargs)
             # here we have scores [tgt_lenxbatch, vocab] or [beamxbatch, vocab]
             if batch_offset is None:
                 scores = scores.view(batch.batch_size, -1, scores.size(-1))
@@ -604,7 +850,8 @@ class Translator(object):
                 self._tgt_vocab,
                 src_vocabs,
                 batch_dim=0,
-                batch_offset=batch_offset
+                batch_offset=batch_offset,
+                shortlist=shortlist
             )
             scores = scores.view(decoder_in.size(0), -1, scores.size(-1))
             log_probs = scores.squeeze(0).log()
@@ -620,7 +867,9 @@ class Translator(object):
             min_length=0,
             n_best=1,
             return_attention=False,
-            training=False):
+            training=False,
+            enc_out=None,
+            keep_dec_outputs=False):
         # TODO: support these blacklisted features.
         assert not self.dump_beam
 
@@ -632,7 +881,8 @@ class Translator(object):
             max_tgt_length = batch.tgt.size(0)
             max_length = max_tgt_length - 1
         # (1) Run the encoder on the src.
-        src, enc_states, memory_bank, src_lengths = self._run_encoder(batch)
+        src, enc_states, memory_bank, src_lengths = self._run_encoder(
+            batch, enc_out)
         self.model.decoder.init_state(src, memory_bank, enc_states)
 
         results = {
@@ -642,22 +892,37 @@ class Translator(object):
             "batch": batch,
             "gold_score": self._gold_score(
                 batch, memory_bank, src_lengths, src_vocabs, use_src_map,
-                enc_states, batch_size, src)}
+                enc_states, batch_size, src, training=training)}
 
-        # (2) Repeat src objects `beam_size` times.
+        # (2) Repeat the decoder state `beam_size` times.
         # We use batch_size x beam_size
-        src_map = (tile(batch.src_map, beam_size, dim=1)
-                   if use_src_map else None)
         self.model.decoder.map_state(
             lambda state, dim: tile(state, beam_size, dim=dim))
-
+        # the beams of a sentence attend to the same memory bank entry,
+        # decoders that cannot share it get `beam_size` copies
+        share_memory = getattr(self.model.decoder, "shares_memory_bank",
+                               False)
+        src_map = batch.src_map if use_src_map else None
+        memory_lengths = src_lengths
+        if not share_memory:
+            if src_map is not None:
+                src_map = tile(src_map, beam_size, dim=1)
+            memory_lengths = tile(src_lengths, beam_size)
+            if isinstance(memory_bank, tuple):
+                memory_bank = tuple(tile(x, beam_size, dim=1)
+                                    for x in memory_bank)
+            else:
+                memory_bank = tile(memory_bank, beam_size, dim=1)
         if isinstance(memory_bank, tuple):
-            memory_bank = tuple(tile(x, beam_size, dim=1) for x in memory_bank)
             mb_device = memory_bank[0].device
         else:
-            memory_bank = tile(memory_bank, beam_size, dim=1)
             mb_device = memory_bank.device
-        memory_lengths = tile(src_lengths, beam_size)
+
+        shortlist = None
+        exclusion_tokens = self._exclusion_idxs
+        if self.vocab_shortlist > 0 and not training:
+            shortlist = self._build_shortlist(batch, src_vocabs)
+            exclusion_tokens = self._shortlist_exclusion(shortlist)
 
         # (0) pt 2, prep the beam object
         beam = BeamSearch(
@@ -674,8 +939,10 @@ class Translator(object):
             return_attention=return_attention,
             stepwise_penalty=self.stepwise_penalty,
             block_ngram_repeat=self.block_ngram_repeat,
-            exclusion_tokens=self._exclusion_idxs,
-            memory_lengths=memory_lengths)
+            exclusion_tokens=exclusion_tokens,
+            memory_lengths=src_lengths,
+            keep_dec_outputs=keep_dec_outputs,
+            bound_stopping=self.beam_bound_stopping)
 
         for step in range(max_length):
             # current_predictions: batch_size * beam_size
@@ -690,13 +957,16 @@ class Translator(object):
                 memory_lengths=memory_lengths,
                 src_map=src_map,
                 step=step,
-                batch_offset=beam._batch_offset)
+                batch_offset=beam._batch_offset,
+                shortlist=shortlist,
+                beam_size=beam_size if share_memory else None)
 
             beam.advance(log_probs, attn, dec_out_attn)
 
+            n_alive = len(beam._batch_offset)
             any_beam_is_finished = beam.is_finished.any()
             # we do not early stop while training.
-            if any_beam_is_finished:
+            if any_beam_is_finished or (beam.bound_stopping and not training):
                 beam.update_finished(training)
                 if beam.done and not training:
                     max_length = step
@@ -704,29 +974,40 @@ class Translator(object):
 
             select_indices = beam.current_origin
 
-            if any_beam_is_finished:
+            # batches retired by their score bound shrink the batch too
+            batch_shrunk = len(beam._batch_offset) < n_alive
+            if batch_shrunk or (any_beam_is_finished and not share_memory):
                 # Reorder states.
+                memory_indices = beam.current_batch_origin \
+                    if share_memory else select_indices
                 if isinstance(memory_bank, tuple):
-                    memory_bank = tuple(x.index_select(1, select_indices)
+                    memory_bank = tuple(x.index_select(1, memory_indices)
                                         for x in memory_bank)
                 else:
-                    memory_bank = memory_bank.index_select(1, select_indices)
+                    memory_bank = memory_bank.index_select(1, memory_indices)
 
-                memory_lengths = memory_lengths.index_select(0, select_indices)
+                memory_lengths = memory_lengths.index_select(0, memory_indices)
 
                 if src_map is not None:
-                    src_map = src_map.index_select(1, select_indices)
+                    src_map = src_map.index_select(1, memory_indices)
+
+                self.model.decoder.map_memory_state(
+                    lambda state, dim: state.index_select(dim, memory_indices))
 
             self.model.decoder.map_state(
                 lambda state, dim: state.index_select(dim, select_indices))
         # batch_size * beam_size
         results["scores"] = beam.scores
         results["predictions"] = beam.predictions
+        if shortlist is not None:
+            results["predictions"] = [
+                [self._from_shortlist(pred, shortlist[0]) for pred in preds]
+                for preds in results["predictions"]]
         results["attention"] = beam.attention
-        results["hypotheses"] = beam.hypotheses
-        if training:
-            results["dec_outputs"] = beam.dec_outputs.view(max_length, batch_size, beam_size, -1)
-            results["dec_attns"] = beam.dec_attns
+        if keep_dec_outputs:
+            dec_outputs, dec_attns = beam.gather_dec_outputs()
+            results["dec_outputs"] = dec_outputs.view(max_length, batch_size, beam_size, -1)
+            results["dec_attns"] = dec_attns
             for key in results["dec_attns"]:
                 results["dec_attns"][key] = results["dec_attns"][key].view(max_length, batch_size, beam_size, -1)
             assert max_length == batch.tgt.size(0) - 1, "max_length {}, tgt {}".format(max_length, batch.tgt.size())
@@ -95,6 +95,10 @@ class ArgumentParser(cfargparse.ArgumentParser):
     def validate_translate_opts(cls, opt):
         if opt.beam_size != 1 and opt.random_sampling_topk != 1:
             raise ValueError('Can either do beam search OR random sampling.')
+        if opt.quantize is not None and opt.gpu > -1:
+            raise ValueError('Quantized models only run on CPU.')
+        if opt.workers > 1 and opt.gpu > -1:
+            raise ValueError('Worker processes only translate on CPU.')
 
     @classmethod
     def validate_preprocess_args(cls, opt):
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""HTTP front-end of :class:`onmt.translate.TranslationServer`.
+
+Requests are served by an asyncio event loop, models run in a dedicated
+thread pool. At most ``-max_in_flight`` requests are handled at once,
+further ones get a ``503`` with a ``Retry-After`` header. Connections
+are kept alive as HTTP/1.1 specifies, until idle for
+``-keep_alive_timeout`` seconds.
+
+Routes, under ``-url_root``:
+
+* ``GET /models``, ``GET /health``, ``GET /residency``
+* ``POST /translate`` with ``[{"id": model_id, "src": "...",
+  "history": "..."}, ...]``
+* ``POST /session/open``, ``/session/run``, ``/session/close`` (see
+  :func:`onmt.translate.TranslationServer.open_session()`)
+* ``POST /unload_model/<model_id>``
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from onmt.translate.translation_server import (TranslationServer,
+                                               ServerModelError)
+from onmt.utils.logging import init_logger
+
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                  405: "Method Not Allowed", 413: "Payload Too Large",
+                  500: "Internal Server Error",
+                  503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super(HTTPError, self).__init__(message or STATUS_REASONS[status])
+        self.status = status
+
+
+class Frontend(object):
+    """Serve ``translation_server`` over HTTP.
+
+    Args:
+        translation_server (TranslationServer): started server
+        url_root (str): prefix of the routes
+        max_in_flight (int): requests handled at once
+        executor_threads (int): threads running the models, as many as
+            ``max_in_flight`` if not set, so that every request in
+            flight can join a micro-batch
+        retry_after (int): seconds sent with ``503`` responses
+        keep_alive_timeout (float): seconds an idle connection is kept
+        max_body_size (int): largest request body accepted, in bytes
+    """
+
+    def __init__(self, translation_server, url_root="/translator",
+                 max_in_flight=64, executor_threads=None, retry_after=1,
+                 keep_alive_timeout=15, max_body_size=1 << 20):
+        self.translation_server = translation_server
+        self.url_root = url_root.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_body_size = max_body_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=executor_threads or max_in_flight)
+        self.in_flight = 0
+        self.routes = {
+            ("GET", "/models"): self.list_models,
+            ("GET", "/health"): self.health,
+            ("GET", "/residency"): self.residency,
+            ("POST", "/translate"): self.translate,
+            ("POST", "/session/open"): self.open_session,
+            ("POST", "/session/run"): self.run_session,
+            ("POST", "/session/close"): self.close_session,
+        }
+
+    # Routes, run in the executor
+
+    def list_models(self, inputs):
+        return self.translation_server.list_models()
+
+    def health(self, inputs):
+        return {"status": "ok", "in_flight": self.in_flight}
+
+    def residency(self, inputs):
+        return self.translation_server.residency_stats()
+
+    def translate(self, inputs):
+        trans, scores, n_best, times = self.translation_server.run(inputs)
+        assert len(trans) == len(inputs) * n_best
+        assert len(scores) == len(inputs) * n_best
+        out = [[] for _ in range(n_best)]
+        for i in range(len(trans)):
+            out[i % n_best].append({"src": inputs[i // n_best]["src"],
+                                    "tgt": trans[i], "n_best": n_best,
+                                    "pred_score": scores[i]})
+        return {"results": out, "times": times}
+
+    def open_session(self, inputs):
+        return {"session": self.translation_server.open_session(inputs)}
+
+    def run_session(self, inputs):
+        tgt, score, times = self.translation_server.run_session(inputs)
+        return {"tgt": tgt, "pred_score": score, "times": times}
+
+    def close_session(self, inputs):
+        self.translation_server.close_session(inputs)
+        return {"status": "ok"}
+
+    def unload_model(self, model_id, inputs):
+        self.translation_server.unload_model(model_id)
+        return {"status": "ok", "model_id": model_id}
+
+    def _route(self, method, path):
+        if not path.startswith(self.url_root + "/"):
+            raise HTTPError(404)
+        path = path[len(self.url_root):]
+        if path.startswith("/unload_model/"):
+            if method != "POST":
+                raise HTTPError(405)
+            try:
+                model_id = int(path[len("/unload_model/"):])
+            except ValueError:
+                raise HTTPError(404)
+            return partial(self.unload_model, model_id)
+        if (method, path) in self.routes:
+            return self.routes[(method, path)]
+        if any(p == path for _, p in self.routes):
+            raise HTTPError(405)
+        raise HTTPError(404)
+
+    # HTTP
+
+    async def _read_request(self, reader):
+        """Read a request, None when the client closed the connection."""
+        request_line = await asyncio.wait_for(
+            reader.readline(), self.keep_alive_timeout)
+        if not request_line:
+            return None
+        try:
+            method, target, version = \
+                request_line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "transfer-encoding" in headers:
+            raise HTTPError(400, "Chunked request bodies are not supported")
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body_size:
+            raise HTTPError(413)
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method, target.split("?")[0], version, headers, body
+
+    def _write_response(self, writer, status, payload, keep_alive,
+                        extra_headers=()):
+        body = json.dumps(payload).encode("utf-8")
+        headers = ["HTTP/1.1 %d %s" % (status, STATUS_REASONS[status]),
+                   "Content-Type: application/json",
+                   "Content-Length: %d" % len(body),
+                   "Connection: %s" % ("keep-alive" if keep_alive
+                                       else "close")]
+        headers.extend(extra_headers)
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1")
+                     + body)
+
+    async def _respond(self, method, path, body):
+        """Status, payload and extra headers of a request."""
+        handler = self._route(method, path)
+        if self.in_flight >= self.max_in_flight:
+            return 503, {"error": "Too many requests in flight"}, \
+                ["Retry-After: %d" % self.retry_after]
+        try:
+            inputs = json.loads(body.decode("utf-8")) if body else None
+        except ValueError:
+            raise HTTPError(400, "Request body is not JSON")
+        self.in_flight += 1
+        try:
+            out = await asyncio.get_event_loop().run_in_executor(
+                self.executor, handler, inputs)
+        except ServerModelError as e:
+            return 500, {"error": str(e)}, []
+        except (KeyError, TypeError, IndexError) as e:
+            return 400, {"error": "Bad request: %r" % e}, []
+        finally:
+            self.in_flight -= 1
+        return 200, out, []
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.TimeoutError,
+                        asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as e:
+                    self._write_response(writer, e.status,
+                                         {"error": str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" \
+                    if version == "HTTP/1.0" else connection != "close"
+                try:
+                    status, out, extra = await self._respond(
+                        method, path, body)
+                except HTTPError as e:
+                    status, out, extra = e.status, {"error": str(e)}, []
+                self._write_response(writer, status, out, keep_alive,
+                                     extra)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def start(config_file, url_root="/translator", host="0.0.0.0", port=5000,
+          **frontend_kwargs):
+    init_logger()
+    translation_server = TranslationServer()
+    translation_server.start(config_file)
+    frontend = Frontend(translation_server, url_root=url_root,
+                        **frontend_kwargs)
+
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(
+        frontend.handle_connection, host, port))
+    print("Serving on http://%s:%d%s" % (host, port, url_root))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        frontend.executor.shutdown(wait=False)
+        loop.close()
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description="OpenNMT-py REST Server")
+    parser.add_argument("--ip", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default="5000")
+    parser.add_argument("--url_root", type=str, default="/translator")
+    parser.add_argument("--config", "-c", type=str,
+                        default="./available_models/conf.json")
+    parser.add_argument("--max_in_flight", type=int, default=64,
+                        help="Requests handled at once, further ones get "
+                             "a 503 response")
+    parser.add_argument("--executor_threads", type=int, default=None,
+                        help="Threads running the models, "
+                             "max_in_flight if not set")
+    parser.add_argument("--retry_after", type=int, default=1,
+                        help="Retry-After seconds of 503 responses")
+    parser.add_argument("--keep_alive_timeout", type=float, default=15,
+                        help="Seconds an idle connection is kept open")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _get_parser()
+    args = parser.parse_args()
+    start(args.config, url_root=args.url_root, host=args.ip,
+          port=args.port, max_in_flight=args.max_in_flight,
+          executor_threads=args.executor_threads,
+          retry_after=args.retry_after,
+          keep_alive_timeout=args.keep_alive_timeout)
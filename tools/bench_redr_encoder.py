@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Benchmark of the ReDR encoder with and without length-aware memory hops.
+
+Batches are drawn either from the passage and history lengths of a
+preprocessed training set (``-data``) or from skewed synthetic lengths,
+then grouped two ways: bucketed by passage length, and shuffled. For
+each grouping the per-batch encoder time is reported with the memory
+hops run over every padded position (``padded``), as before, and with
+the lengths passed through (``packed``).
+
+With ``-branch_threads`` the latency of small inference batches is
+also compared between encoding the passage and the history one after
+the other and concurrently (see ``-encoder_branch_threads``).
+"""
+import argparse
+import glob
+import random
+import time
+
+import torch
+
+from onmt.encoders.redr_encoder import ReDREncoder
+from onmt.modules import Embeddings
+
+
+def load_lengths(opt):
+    if opt.data:
+        lengths = []
+        for path in sorted(glob.glob(opt.data + '.train*.pt')):
+            for ex in torch.load(path).examples:
+                lengths.append((len(ex.src[0]), len(ex.history[0])))
+        return lengths
+    rng = random.Random(opt.seed)
+    # long tail of passages and histories, as in CoQA
+    return [(min(opt.max_doc_len, max(10, int(rng.lognormvariate(5.0, 0.5)))),
+             min(opt.max_history_len, max(1, int(rng.lognormvariate(3.0, 0.8)))))
+            for _ in range(opt.n_examples)]
+
+
+def make_batches(lengths, batch_size, bucketed, seed):
+    lengths = list(lengths)
+    random.Random(seed).shuffle(lengths)
+    if bucketed:
+        lengths.sort(key=lambda x: x[0])
+    batches = [lengths[i:i + batch_size]
+               for i in range(0, len(lengths), batch_size)]
+    # the reference encoder packs, so passages are sorted in a batch
+    return [sorted(batch, key=lambda x: -x[0]) for batch in batches]
+
+
+def encode(encoder, src, history, src_lengths, history_lengths, packed):
+    enc_state, memory_bank, src_lengths = encoder.reference_encoder(src, src_lengths)
+    history_enc_state, history_memory_bank, history_lengths = \
+        encoder.history_encoder(history, history_lengths, resort=True)
+    if packed:
+        return encoder.redr_layer(enc_state, history_enc_state, memory_bank, history_memory_bank,
+                                  src_lengths, history_lengths)
+    return encoder.redr_layer(enc_state, history_enc_state, memory_bank, history_memory_bank)
+
+
+def bench_branches(encoder, lengths, opt, device):
+    """Per-batch latency of sequential and concurrent encoder branches."""
+    for batch_size in opt.latency_batch_sizes:
+        batches = make_batches(lengths, batch_size, False,
+                               opt.seed)[:opt.max_batches]
+        times = {}
+        for n_threads in (0, opt.branch_threads):
+            encoder.set_branch_threads(n_threads)
+            total = 0.0
+            for batch in batches:
+                src, history, src_lengths, history_lengths = \
+                    make_inputs(batch, opt.vocab_size, device)
+                with torch.no_grad():
+                    start = time.time()
+                    encoder(src, history, src_lengths, history_lengths)
+                    total += time.time() - start
+            times[n_threads] = total * 1000 / len(batches)
+        encoder.set_branch_threads(0)
+        print('batch %-3d sequential %.2f ms, concurrent (%d threads) '
+              '%.2f ms, speedup %.2fx'
+              % (batch_size, times[0], opt.branch_threads,
+                 times[opt.branch_threads],
+                 times[0] / times[opt.branch_threads]))
+
+
+def make_inputs(batch, vocab_size, device):
+    src_lengths = torch.tensor([x[0] for x in batch], device=device)
+    history_lengths = torch.tensor([x[1] for x in batch], device=device)
+    src = torch.randint(2, vocab_size, (src_lengths.max().item(), len(batch), 1),
+                        device=device)
+    history = torch.randint(2, vocab_size, (history_lengths.max().item(), len(batch), 1),
+                            device=device)
+    return src, history, src_lengths, history_lengths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_redr_encoder.py')
+    parser.add_argument('-data', default=None,
+                        help="Path prefix of preprocessed data to take the "
+                             "lengths from, synthetic lengths if unset")
+    parser.add_argument('-n_examples', type=int, default=2048)
+    parser.add_argument('-max_doc_len', type=int, default=400)
+    parser.add_argument('-max_history_len', type=int, default=100)
+    parser.add_argument('-batch_size', type=int, default=32)
+    parser.add_argument('-max_batches', type=int, default=50)
+    parser.add_argument('-hidden_size', type=int, default=600)
+    parser.add_argument('-word_vec_size', type=int, default=300)
+    parser.add_argument('-vocab_size', type=int, default=20000)
+    parser.add_argument('-n_memory_layers', type=int, default=3)
+    parser.add_argument('-rnn_type', default='LSTM', choices=['GRU', 'LSTM'])
+    parser.add_argument('-branch_threads', type=int, default=0,
+                        help="Also time the concurrent encoder branches, "
+                             "the history branch using this many threads")
+    parser.add_argument('-latency_batch_sizes', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument('-gpu', type=int, default=-1)
+    parser.add_argument('-seed', type=int, default=3435)
+    opt = parser.parse_args()
+
+    torch.manual_seed(opt.seed)
+    device = torch.device('cuda', opt.gpu) if opt.gpu > -1 \
+        else torch.device('cpu')
+    embeddings = Embeddings(opt.word_vec_size, opt.vocab_size, 1)
+    encoder = ReDREncoder(opt.rnn_type, True, 1, opt.hidden_size,
+                          embeddings=embeddings,
+                          n_memory_layers=opt.n_memory_layers).to(device)
+    encoder.eval()
+
+    lengths = load_lengths(opt)
+    for bucketed in (True, False):
+        batches = make_batches(lengths, opt.batch_size, bucketed,
+                               opt.seed)[:opt.max_batches]
+        times = {False: 0.0, True: 0.0}
+        real, padded = 0, 0
+        for batch in batches:
+            src, history, src_lengths, history_lengths = \
+                make_inputs(batch, opt.vocab_size, device)
+            real += src_lengths.sum().item()
+            padded += src.size(0) * len(batch)
+            for packed in (False, True):
+                with torch.no_grad():
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize()
+                    start = time.time()
+                    encode(encoder, src, history, src_lengths,
+                           history_lengths, packed)
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize()
+                    times[packed] += time.time() - start
+        n = len(batches)
+        print('%-9s %d batches, %.1f%% passage padding: padded %.2f ms, '
+              'packed %.2f ms per batch, speedup %.2fx'
+              % ('bucketed' if bucketed else 'shuffled', n,
+                 100.0 * (padded - real) / padded,
+                 times[False] * 1000 / n, times[True] * 1000 / n,
+                 times[False] / times[True]))
+
+    if opt.branch_threads > 0:
+        bench_branches(encoder, lengths, opt, device)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the ReDR memory layer.
+
+Times :class:`onmt.encoders.redr_encoder.ReDRLayer` against the
+original formulation of its memory hops (kept below as ``reference``)
+and checks that both give the same passage encoding and gradients.
+"""
+import argparse
+import time
+
+import torch
+
+from onmt.encoders.redr_encoder import ReDRLayer
+
+
+def reference(layer, doc_encoder_outputs, que_encoder_outputs):
+    """Memory hops as written before the gate projections were fused."""
+    doc_encoder_outputs = doc_encoder_outputs.transpose(0, 1)
+    que_encoder_outputs = que_encoder_outputs.transpose(0, 1)
+    batch_size = doc_encoder_outputs.size(0)
+    hidden_size = layer.hidden_size
+    _R = doc_encoder_outputs
+    _C = que_encoder_outputs
+    encoder_hidden = None
+    for i in range(layer.n_memory_layers):
+        _S = torch.bmm(_R, _C.transpose(1, 2))
+        _H = torch.bmm(_R.transpose(1, 2), torch.softmax(_S, dim=-1))
+        _G0 = torch.cat((_C.transpose(1, 2), _H), dim=1)
+        _G = torch.bmm(_G0, torch.softmax(_S.transpose(1, 2), dim=-1))
+        u_inp = torch.cat((_R, _G.transpose(1, 2)), dim=-1)
+        u_outputs, encoder_hidden = layer.merge_encoder(u_inp)
+        if i == 0:
+            _R = u_outputs
+        else:
+            item_a = torch.mm(u_outputs.contiguous().view(-1, hidden_size), layer._w_u)\
+                .contiguous().view(batch_size, -1)
+            item_b = torch.mm(_G.transpose(1, 2).contiguous().view(-1, 2 * hidden_size), layer._w_c)\
+                .contiguous().view(batch_size, -1)
+            item_c = torch.mm(_R.contiguous().view(-1, hidden_size), layer._w_r)\
+                .contiguous().view(batch_size, -1)
+            gates = torch.sigmoid(item_a + item_b + item_c + layer._b).unsqueeze(-1)
+            _R = gates * _R + (1 - gates) * u_outputs
+    return encoder_hidden, _R
+
+
+def timed(fn, repeat, backward, device):
+    times = []
+    for _ in range(repeat + 1):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.time()
+        _, out = fn()
+        if backward:
+            out.sum().backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.time() - start)
+    # the first run warms up
+    return sum(times[1:]) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_redr_layer.py')
+    parser.add_argument('-batch_size', type=int, default=32)
+    parser.add_argument('-doc_len', type=int, default=250,
+                        help="Passage length in tokens")
+    parser.add_argument('-history_len', type=int, default=60,
+                        help="Conversation history length in tokens")
+    parser.add_argument('-hidden_size', type=int, default=600)
+    parser.add_argument('-n_memory_layers', type=int, default=3)
+    parser.add_argument('-rnn_type', default='GRU', choices=['GRU', 'LSTM'])
+    parser.add_argument('-repeat', type=int, default=20)
+    parser.add_argument('-backward', action='store_true',
+                        help="Time forward and backward passes")
+    parser.add_argument('-gpu', type=int, default=-1)
+    parser.add_argument('-seed', type=int, default=3435)
+    opt = parser.parse_args()
+
+    torch.manual_seed(opt.seed)
+    device = torch.device('cuda', opt.gpu) if opt.gpu > -1 \
+        else torch.device('cpu')
+    layer = ReDRLayer(opt.hidden_size, opt.rnn_type,
+                      n_memory_layers=opt.n_memory_layers).to(device)
+    # keep the gates away from saturation so the check means something
+    for p in (layer._w_u, layer._w_c, layer._w_r):
+        p.data.mul_(opt.hidden_size ** -0.5)
+    doc = torch.randn(opt.doc_len, opt.batch_size, opt.hidden_size,
+                      device=device, requires_grad=True)
+    que = torch.randn(opt.history_len, opt.batch_size, opt.hidden_size,
+                      device=device, requires_grad=True)
+
+    outputs = []
+    for fn in (lambda: reference(layer, doc, que),
+               lambda: layer(None, None, doc, que)):
+        layer.zero_grad()
+        doc.grad = None
+        _, out = fn()
+        out.sum().backward()
+        outputs.append([out.detach(), doc.grad.clone()]
+                       + [torch.zeros_like(p) if p.grad is None else p.grad.clone()
+                          for p in layer.parameters()])
+    for name, ref, new in zip(['output', 'input grad', 'param grads'],
+                              outputs[0][:2] + [outputs[0][2:]],
+                              outputs[1][:2] + [outputs[1][2:]]):
+        if isinstance(ref, list):
+            diff = max((r - n).abs().max().item() for r, n in zip(ref, new))
+            close = all(torch.allclose(r, n, rtol=1e-4, atol=1e-4)
+                        for r, n in zip(ref, new))
+        else:
+            diff = (ref - new).abs().max().item()
+            close = torch.allclose(ref, new, rtol=1e-4, atol=1e-4)
+        print('%-12s max abs diff %.3e %s'
+              % (name, diff, 'ok' if close else 'MISMATCH'))
+
+    grad_control = torch.enable_grad if opt.backward else torch.no_grad
+    with grad_control():
+        ref_time = timed(lambda: reference(layer, doc, que),
+                         opt.repeat, opt.backward, device)
+        new_time = timed(lambda: layer(None, None, doc, que),
+                         opt.repeat, opt.backward, device)
+    print('reference %.2f ms, fused %.2f ms, speedup %.2fx'
+          % (ref_time * 1000, new_time * 1000, ref_time / new_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Load generator for a running ``server.py``.
+
+``-concurrency`` clients, each on its own keep-alive connection, send
+``/translate`` requests built from the lines of ``-src`` and
+``-history`` for ``-duration`` seconds or ``-n_requests`` requests.
+The latency percentiles of the successful requests, the throughput and
+the number of ``503`` responses are reported.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of ``sorted_values``."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(0, int(round(p / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def read_inputs(opt):
+    with open(opt.src) as f:
+        src = [line.strip() for line in f]
+    if opt.history:
+        with open(opt.history) as f:
+            history = [line.strip() for line in f]
+    else:
+        history = [""] * len(src)
+    return [{"id": opt.model_id, "src": s, "history": h}
+            for s, h in zip(src, history)]
+
+
+class Client(threading.Thread):
+    def __init__(self, opt, inputs, offset, counter, deadline):
+        super(Client, self).__init__()
+        self.daemon = True
+        self.opt = opt
+        self.inputs = inputs
+        self.offset = offset
+        self.counter = counter
+        self.deadline = deadline
+        self.latencies = []
+        self.status = {}
+        self.errors = 0
+
+    def run(self):
+        path = self.opt.url_root.rstrip("/") + "/translate"
+        conn = http.client.HTTPConnection(self.opt.host, self.opt.port)
+        i = self.offset
+        while time.time() < self.deadline and self.counter.take():
+            batch = [self.inputs[(i + j) % len(self.inputs)]
+                     for j in range(self.opt.inputs_per_request)]
+            i += self.opt.concurrency * self.opt.inputs_per_request
+            start = time.time()
+            try:
+                conn.request("POST", path, body=json.dumps(batch),
+                             headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection(self.opt.host,
+                                                  self.opt.port)
+                continue
+            self.status[response.status] = \
+                self.status.get(response.status, 0) + 1
+            if response.status == 200:
+                self.latencies.append(time.time() - start)
+            elif response.status == 503:
+                time.sleep(self.opt.backoff)
+            if response.getheader("Connection", "") == "close":
+                conn.close()
+        conn.close()
+
+
+class Counter(object):
+    """Requests left to send, shared by the clients."""
+
+    def __init__(self, n):
+        self.n = n
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.n is not None:
+                if self.n <= 0:
+                    return False
+                self.n -= 1
+            return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bench_server.py")
+    parser.add_argument("-src", required=True,
+                        help="Passages, one per line")
+    parser.add_argument("-history", default=None,
+                        help="Histories, one per line, empty if unset")
+    parser.add_argument("-host", default="localhost")
+    parser.add_argument("-port", type=int, default=5000)
+    parser.add_argument("-url_root", default="/translator")
+    parser.add_argument("-model_id", type=int, default=0)
+    parser.add_argument("-concurrency", type=int, default=8)
+    parser.add_argument("-inputs_per_request", type=int, default=1)
+    parser.add_argument("-duration", type=float, default=30,
+                        help="Seconds to send requests for")
+    parser.add_argument("-n_requests", type=int, default=None,
+                        help="Stop after this many requests")
+    parser.add_argument("-backoff", type=float, default=0.05,
+                        help="Seconds a client waits after a 503")
+    opt = parser.parse_args()
+
+    inputs = read_inputs(opt)
+    counter = Counter(opt.n_requests)
+    start = time.time()
+    clients = [Client(opt, inputs, k * opt.inputs_per_request, counter,
+                      start + opt.duration)
+               for k in range(opt.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(sum((c.latencies for c in clients), []))
+    status = {}
+    for client in clients:
+        for code, n in client.status.items():
+            status[code] = status.get(code, 0) + n
+    errors = sum(c.errors for c in clients)
+    print("%d requests in %.1fs, %.2f req/s ok, status %s, "
+          "%d connection errors"
+          % (sum(status.values()), elapsed, len(latencies) / elapsed,
+             " ".join("%d:%d" % kv for kv in sorted(status.items())),
+             errors))
+    print("latency ms p50 %.1f p95 %.1f p99 %.1f max %.1f"
+          % tuple(1000 * v for v in (
+              percentile(latencies, 50), percentile(latencies, 95),
+              percentile(latencies, 99),
+              latencies[-1] if latencies else float("nan"))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""Export a trained checkpoint to a self-contained TorchScript archive.
+
+The archive can be passed to ``generate.py -model`` and to the
+translation server in place of the checkpoint.
+"""
+import argparse
+
+import torch
+
+from onmt.model_builder import load_test_model
+from onmt.models.scripted import export_model
+from onmt.utils.logging import init_logger, logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export_model.py')
+    parser.add_argument('-model', required=True,
+                        help="Path to the model .pt checkpoint")
+    parser.add_argument('-output', required=True,
+                        help="Path of the TorchScript archive")
+    parser.add_argument('-gpu', type=int, default=-1,
+                        help="Device to trace on, the archive runs on the "
+                             "device it is loaded to")
+    opt = parser.parse_args()
+    init_logger()
+
+    if opt.gpu > -1:
+        torch.cuda.set_device(opt.gpu)
+    load_opt = argparse.Namespace(models=[opt.model], data_type='text',
+                                  gpu=opt.gpu, fp32=False)
+    fields, model, model_opt = load_test_model(load_opt)
+    export_model(model, fields, model_opt, opt.output)
+    logger.info('Exported %s to %s' % (opt.model, opt.output))
+
+
+if __name__ == "__main__":
+    main()
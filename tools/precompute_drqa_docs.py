@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Encode every training passage with the DrQA reward model once.
+
+The result is read by training with ``-drqa_doc_store``.
+"""
+import argparse
+import glob
+import os
+
+import torch
+
+from clta.drqa_model import build_drqa
+from clta.doc_store import precompute_doc_encodings
+from onmt.utils.logging import init_logger, logger
+
+
+def main():
+    parser = argparse.ArgumentParser(description='precompute_drqa_docs.py')
+    parser.add_argument('-data', required=True,
+                        help="Path prefix of the preprocessed data, "
+                             "as passed to train.py")
+    parser.add_argument('-drqa_vocab_path',
+                        default=os.path.join("drqa_param", "vocab.pt"))
+    parser.add_argument('-drqa_config_path',
+                        default=os.path.join("drqa_param", "hparams.json"))
+    parser.add_argument('-drqa_model_path',
+                        default=os.path.join("drqa_param", "params/000000010.params"))
+    parser.add_argument('-output', required=True,
+                        help="Directory of the passage store")
+    parser.add_argument('-batch_size', type=int, default=32)
+    parser.add_argument('-gpu', type=int, default=-1,
+                        help="Device to run on")
+    opt = parser.parse_args()
+    init_logger()
+
+    if opt.gpu > -1:
+        torch.cuda.set_device(opt.gpu)
+    drqa = build_drqa(opt.drqa_vocab_path, opt.drqa_config_path,
+                      opt.drqa_model_path, gpu=opt.gpu > -1)
+
+    # same shards and order as the training iterator
+    docs = []
+    for path in sorted(glob.glob(opt.data + '.train*.pt')):
+        examples = torch.load(path).examples
+        logger.info('Loading dataset from %s, number of examples: %d'
+                    % (path, len(examples)))
+        docs.extend(' '.join(ex.src[0]) for ex in examples)
+
+    precompute_doc_encodings(drqa, docs, opt.output, opt.batch_size)
+    logger.info('Wrote %d passage encodings to %s' % (len(docs), opt.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Write an int8 quantized checkpoint and measure what it costs.
+
+The written checkpoint keeps the float weights without optimizer state
+and is marked for dynamic int8 quantization, which ``load_test_model``
+applies when translating or serving it (see ``-quantize``).
+
+Given ``-src``/``-history``/``-tgt`` of a dev set, the dev set is also
+decoded with the float and the quantized model, and the BLEU delta and
+speedup are reported.
+"""
+import os
+import subprocess
+import tempfile
+import time
+
+import torch
+
+import onmt.opts as opts
+from onmt.translate.translator import build_translator
+from onmt.utils.logging import init_logger, logger
+from onmt.utils.misc import split_corpus
+from onmt.utils.parse import ArgumentParser
+
+
+def bleu(pred_path, tgt_path):
+    base_dir = os.path.abspath(__file__ + "/../..")
+    with open(pred_path) as pred:
+        res = subprocess.check_output(
+            "perl %s/tools/multi-bleu.perl %s" % (base_dir, tgt_path),
+            stdin=pred, shell=True).decode("utf-8")
+    # BLEU = 23.45, ...
+    return float(res.split(",")[0].split("=")[1]), res.strip()
+
+
+def decode(opt, model_path, pred_path):
+    opt.models = [model_path]
+    with open(pred_path, "w") as out_file:
+        translator = build_translator(opt, report_score=False,
+                                      out_file=out_file)
+        start = time.time()
+        for src_shard, history_shard in zip(
+                split_corpus(opt.src, opt.shard_size),
+                split_corpus(opt.history, opt.shard_size)):
+            translator.translate(src=src_shard, history=history_shard,
+                                 batch_size=opt.batch_size,
+                                 batch_type=opt.batch_type)
+        return time.time() - start
+
+
+def main(opt):
+    ArgumentParser.validate_translate_opts(opt)
+    logger = init_logger(opt.log_file)
+
+    checkpoint = torch.load(opt.models[0],
+                            map_location=lambda storage, loc: storage)
+    checkpoint['optim'] = None
+    checkpoint['quantize'] = 'int8'
+    torch.save(checkpoint, opt.quantized_model)
+    logger.info('Wrote int8 checkpoint %s' % opt.quantized_model)
+
+    if opt.tgt is None:
+        return
+    torch.set_num_threads(opt.threads or torch.get_num_threads())
+    # the float model, then the checkpoint written above as served
+    opt.quantize = None
+    tmp_dir = tempfile.mkdtemp()
+    results = {}
+    for name, model_path in (('fp32', opt.models[0]),
+                             ('int8', opt.quantized_model)):
+        pred_path = os.path.join(tmp_dir, 'pred.%s.txt' % name)
+        seconds = decode(opt, model_path, pred_path)
+        results[name] = (seconds,) + bleu(pred_path, opt.tgt)
+        logger.info('%s: %.1fs, %s' % (name, seconds, results[name][2]))
+    fp32_time, fp32_bleu, _ = results['fp32']
+    int8_time, int8_bleu, _ = results['int8']
+    logger.info('int8 BLEU delta %+.2f, speedup %.2fx'
+                % (int8_bleu - fp32_bleu, fp32_time / int8_time))
+
+
+def _get_parser():
+    parser = ArgumentParser(description='quantize_model.py')
+    opts.config_opts(parser)
+    opts.translate_opts(parser)
+    group = parser.add_argument_group('Quantization')
+    group.add('--quantized_model', '-quantized_model', required=True,
+              help="Path of the int8 checkpoint to write")
+    group.add('--threads', '-threads', type=int, default=0,
+              help="Intra-op threads while decoding the dev set, "
+                   "0 keeps the PyTorch default")
+    return parser
+
+
+if __name__ == "__main__":
+    parser = _get_parser()
+    main(parser.parse_args())